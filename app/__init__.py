@@ -7,6 +7,8 @@ from werkzeug.security import generate_password_hash
 from dotenv import load_dotenv
 from sqlalchemy.exc import IntegrityError
 from config import config
+from app.fonts import register_fonts
+import logging
 import os
 
 load_dotenv()  # Load environment variables from .env file
@@ -33,12 +35,38 @@ def create_app(config_name='default'):
     bcrypt.init_app(app)
     migrate.init_app(app, db)
 
+    # Parse the sticker fonts now so no print request (including the first after a deploy) pays for it
+    register_fonts(app.root_path)
+
     login_manager.login_view = 'main.login'
     login_manager.login_message_category = 'info'
 
     from app.main import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
+    # Periodic text cache statistics are informational; show them whatever the app logger's level
+    from app.sticker import stats_logger
+    if not stats_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(name)s: %(message)s'))
+        stats_logger.addHandler(handler)
+        stats_logger.setLevel(logging.INFO)
+        stats_logger.propagate = False
+
+    # Compile the sticker layout and pre-scale its images now rather than on the first print
+    from app.sticker import warm_sticker_caches
+    from app.search import ensure_trigram_extension
+    with app.app_context():
+        try:
+            warm_sticker_caches()
+        except Exception as e:
+            app.logger.warning(f'Could not warm sticker caches: {str(e).splitlines()[0]}')
+        # Runs before `flask db upgrade` applies migrations, which need it for the trigram indexes
+        try:
+            ensure_trigram_extension()
+        except Exception as e:
+            app.logger.warning(f'Could not create the pg_trgm extension: {str(e).splitlines()[0]}')
+
     # Import User model locally to avoid circular imports
     from app.models import User
 
@@ -0,0 +1,81 @@
+"""
+Content-addressed cache of rendered print artifacts (sticker PDFs).
+Every artifact is stored as <id>.<ext> in STICKER_ARTIFACT_DIR, where the id is a SHA-256 of everything
+that affects the output. Identical reprints are served from disk, and the directory is kept under
+STICKER_ARTIFACT_MAX_BYTES by evicting the least recently used files.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from flask import current_app
+
+ARTIFACT_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+_eviction_lock = threading.Lock()
+
+def artifact_id_for(*parts):
+    """Hash the given JSON-serialisable parts (dates and decimals are converted with str) into an artifact id."""
+    payload = json.dumps(parts, default=str, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def artifact_dir():
+    path = current_app.config['STICKER_ARTIFACT_DIR']
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def artifact_path(artifact_id, ext='pdf'):
+    if not ARTIFACT_ID_PATTERN.match(artifact_id or ''):
+        raise ValueError(f'Invalid artifact id: {artifact_id}')
+    return os.path.join(artifact_dir(), f'{artifact_id}.{ext}')
+
+def get_artifact(artifact_id, ext='pdf'):
+    """Return the path of a cached artifact and mark it recently used, or None if it is missing or evicted."""
+    path = artifact_path(artifact_id, ext)
+    try:
+        os.utime(path)  # LRU bookkeeping uses mtime
+    except FileNotFoundError:
+        return None
+    return path
+
+@contextmanager
+def write_artifact(artifact_id, ext='pdf'):
+    """
+    Yield a binary file to write the artifact into. It becomes visible atomically once the block
+    completes, so concurrent readers never see a partial file, and the cache is trimmed afterwards.
+    """
+    path = artifact_path(artifact_id, ext)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict_artifacts(keep=path)
+
+def evict_artifacts(max_bytes=None, keep=None):
+    """Delete least recently used artifacts until the cache fits in max_bytes, never removing keep."""
+    max_bytes = current_app.config['STICKER_ARTIFACT_MAX_BYTES'] if max_bytes is None else max_bytes
+    directory = artifact_dir()
+    with _eviction_lock:
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                # Files already being served stay readable until closed
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,224 @@
+"""
+In-process autocomplete over product and category names, so typeahead requests never reach the database.
+Each worker keeps a sorted array of lower-cased names for prefix lookups and a trigram postings table
+for substring and fuzzy matches, ranked like app/search.py. The index is brought up to date from
+updated_at deltas: straight away after this process commits a product or category change, and at most
+every AUTOCOMPLETE_SYNC_INTERVAL seconds otherwise, which picks up changes made by other workers.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from datetime import timedelta
+from flask import current_app
+from app.models import Product, ProductCategory
+from app.search import category_product_counts, find_categories, find_products
+
+# Same rule as app/search.py: shorter terms only match as a prefix
+MIN_TRIGRAM_TERM = 3
+
+# Share of the term's trigrams a name must contain to be a fuzzy match
+MIN_TRIGRAM_SCORE = 0.6
+
+# Rows committed just before a sync can carry an earlier updated_at, so each delta overlaps the last
+SYNC_OVERLAP = timedelta(seconds=30)
+
+def trigrams(text):
+    """Trigrams of lower-cased text, padded at the start like pg_trgm so word starts score higher."""
+    text = '  ' + text
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class NameIndex:
+    """Ids by name: a sorted (name, id) array for prefixes and trigram postings for the rest."""
+    def __init__(self):
+        self.names = {}
+        self.sorted_names = []
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, item_id, name):
+        name = name.lower()
+        if self.names.get(item_id) == name:
+            return
+        self.remove(item_id)
+        self.names[item_id] = name
+        insort(self.sorted_names, (name, item_id))
+        for gram in trigrams(name):
+            self.postings.setdefault(gram, array('I')).append(item_id)
+
+    def remove(self, item_id):
+        name = self.names.pop(item_id, None)
+        if name is None:
+            return
+        del self.sorted_names[bisect_left(self.sorted_names, (name, item_id))]
+        for gram in trigrams(name):
+            ids = self.postings[gram]
+            ids.remove(item_id)
+            if not ids:
+                del self.postings[gram]
+
+    def search(self, term, limit):
+        """Ids of prefix matches in name order, then substring and fuzzy matches by trigram score."""
+        term = term.strip().lower()
+        if not term:
+            return []
+        results = []
+        for name, item_id in self.sorted_names[bisect_left(self.sorted_names, (term,)):]:
+            if not name.startswith(term) or len(results) >= limit:
+                break
+            results.append(item_id)
+        if len(results) >= limit or len(term) < MIN_TRIGRAM_TERM:
+            return results
+
+        grams = trigrams(term)
+        scores = {}
+        for gram in grams:
+            for item_id in self.postings.get(gram, ()):
+                scores[item_id] = scores.get(item_id, 0) + 1
+        found = set(results)
+        ranked = []
+        for item_id, score in scores.items():
+            if item_id in found:
+                continue
+            name = self.names[item_id]
+            if term in name or score >= MIN_TRIGRAM_SCORE * len(grams):
+                ranked.append((-score, name, item_id))
+        ranked.sort()
+        return results + [item_id for _, _, item_id in ranked[:limit - len(results)]]
+
+class AutocompleteIndex:
+    """Product and category names with the fields the typeahead responses need."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.products = NameIndex()
+        self.categories = NameIndex()
+        self.product_details = {}  # id -> (name, category_id, net_weight, rate, shelf_life)
+        self.category_names = {}
+        self.category_counts = {}
+        self.synced_until = None
+        self.checked_at = 0.0
+
+    def _put_product(self, product):
+        details = (product.name, product.category_id, product.net_weight, str(product.rate), product.shelf_life)
+        if self.product_details.get(product.id) == details:
+            return
+        self._drop_product(product.id)
+        self.products.add(product.id, product.name)
+        self.product_details[product.id] = details
+        self.category_counts[product.category_id] = self.category_counts.get(product.category_id, 0) + 1
+
+    def _drop_product(self, product_id):
+        details = self.product_details.pop(product_id, None)
+        if details is not None:
+            self.products.remove(product_id)
+            self.category_counts[details[1]] -= 1
+
+    def _put_category(self, category):
+        self.categories.add(category.id, category.name)
+        self.category_names[category.id] = category.name
+
+    def _drop_category(self, category_id):
+        self.categories.remove(category_id)
+        self.category_names.pop(category_id, None)
+
+    def sync(self, force=False):
+        """
+        Apply product and category rows changed since the last sync, and drop deleted ones.
+        Unless forced, does nothing if the last sync was under AUTOCOMPLETE_SYNC_INTERVAL seconds ago.
+        """
+        now = time.monotonic()
+        if not force and now - self.checked_at < current_app.config['AUTOCOMPLETE_SYNC_INTERVAL']:
+            return
+        with self.lock:
+            # Another thread may have synced while this one waited
+            if not force and now - self.checked_at < current_app.config['AUTOCOMPLETE_SYNC_INTERVAL']:
+                return
+            self.checked_at = now
+            products = Product.query.with_entities(Product.id, Product.name, Product.category_id, Product.net_weight,
+                                                   Product.rate, Product.shelf_life, Product.updated_at)
+            categories = ProductCategory.query.with_entities(ProductCategory.id, ProductCategory.name,
+                                                             ProductCategory.updated_at)
+            if self.synced_until is not None:
+                since = self.synced_until - SYNC_OVERLAP
+                products = products.filter(Product.updated_at >= since)
+                categories = categories.filter(ProductCategory.updated_at >= since)
+            changed_products, changed_categories = products.all(), categories.all()
+            for category in changed_categories:
+                self._put_category(category)
+            for product in changed_products:
+                self._put_product(product)
+            for row in changed_products + changed_categories:
+                if self.synced_until is None or row.updated_at > self.synced_until:
+                    self.synced_until = row.updated_at
+
+            # Deletions leave no delta; a count that no longer matches means some ids have gone
+            if Product.query.count() != len(self.product_details):
+                product_ids = {product_id for product_id, in Product.query.with_entities(Product.id)}
+                for product_id in set(self.product_details) - product_ids:
+                    self._drop_product(product_id)
+            if ProductCategory.query.count() != len(self.category_names):
+                category_ids = {category_id for category_id, in ProductCategory.query.with_entities(ProductCategory.id)}
+                for category_id in set(self.category_names) - category_ids:
+                    self._drop_category(category_id)
+
+    def search_products(self, term, limit=None):
+        """Product dicts for the typeahead, best match first."""
+        self.sync()
+        with self.lock:
+            results = []
+            for product_id in self.products.search(term, limit or current_app.config['SEARCH_RESULT_LIMIT']):
+                name, category_id, net_weight, rate, shelf_life = self.product_details[product_id]
+                results.append({
+                    'id': product_id,
+                    'name': name,
+                    'shelf_life': shelf_life,
+                    'category': self.category_names.get(category_id, 'N/A'),
+                    'net_weight': net_weight,
+                    'rate': rate
+                })
+            return results
+
+    def search_categories(self, term, limit=None):
+        """Category dicts with their product counts, best match first."""
+        self.sync()
+        with self.lock:
+            return [{'id': category_id,
+                     'name': self.category_names[category_id],
+                     'product_count': self.category_counts.get(category_id, 0)}
+                    for category_id in self.categories.search(term, limit or current_app.config['SEARCH_RESULT_LIMIT'])]
+
+autocomplete_index = AutocompleteIndex()
+
+def autocomplete_products(term):
+    """Typeahead product matches from the index, or from the database if the index cannot be synced."""
+    try:
+        return autocomplete_index.search_products(term)
+    except Exception as e:
+        current_app.logger.error(f'Autocomplete index unavailable, searching the database: {str(e)}')
+        return [{
+            'id': p.id,
+            'name': p.name,
+            'shelf_life': p.shelf_life,
+            'category': p.category.name if p.category else 'N/A',
+            'net_weight': p.net_weight,
+            'rate': str(p.rate)
+        } for p in find_products(term)]
+
+def autocomplete_categories(term):
+    """Typeahead category matches from the index, or from the database if the index cannot be synced."""
+    try:
+        return autocomplete_index.search_categories(term)
+    except Exception as e:
+        current_app.logger.error(f'Autocomplete index unavailable, searching the database: {str(e)}')
+        categories = find_categories(term)
+        counts = category_product_counts([c.id for c in categories])
+        return [{'id': c.id, 'name': c.name, 'product_count': counts[c.id]} for c in categories]
+
+def refresh_autocomplete():
+    """Bring this worker's index up to date after committing a product or category change."""
+    try:
+        autocomplete_index.sync(force=True)
+    except Exception as e:
+        current_app.logger.error(f'Error refreshing the autocomplete index: {str(e)}')
@@ -0,0 +1,210 @@
+"""
+Micro-benchmarks for sticker rendering, exposed as `flask bench-*` commands in run.py.
+They build everything in memory and never write to the database.
+"""
+import io
+import os
+import random
+import time
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from datetime import date, timedelta
+from reportlab.pdfgen import canvas
+
+from sqlalchemy import event
+
+from app import db
+from app.models import StickerDesign
+from app.sticker import (Sticker, StickerRun, StoreLayer, compile_layout, create_sticker_pdf, draw_sticker,
+                         wrap_plain_text, layout_text, string_width)
+
+def default_sticker_design():
+    """Return an unsaved StickerDesign populated with the model's column defaults."""
+    design = StickerDesign()
+    for column in StickerDesign.__table__.columns:
+        if column.default is not None and not column.default.is_callable and getattr(design, column.key) is None:
+            setattr(design, column.key, column.default.arg)
+    return design
+
+def sample_stickers(count):
+    """Distinct stickers (unique batch numbers) so form deduplication cannot hide per-sticker cost."""
+    mfg_date = date.today()
+    return [
+        Sticker(
+            product_name='Banana Chips & Jaggery <Classic>',
+            rate='120.00',
+            mfg_date=mfg_date,
+            exp_date=mfg_date + timedelta(days=90),
+            net_weight='200',
+            ingredients='Raw banana, coconut oil, jaggery, salt, turmeric (anti-caking agent E551)',
+            nutritional_facts='Energy Value:    540 kcal\nProtein:         2 g\nCarbohydrates:   60 g\nSugars:          18 g\nTotal Fat:       34 g',
+            batch_number=f'BBCJ{i:08d}',
+            allergen_information='Processed in a facility that also handles tree nuts.'
+        )
+        for i in range(count)
+    ]
+
+def time_per_sticker(plan, stickers):
+    """Average seconds to draw one sticker's product fields, starting from cold text caches."""
+    for cache in (wrap_plain_text, layout_text, string_width):
+        cache.cache_clear()
+    c = canvas.Canvas(io.BytesIO(), pagesize=(plan.width, plan.height))
+    start = time.perf_counter()
+    for sticker in stickers:
+        draw_sticker(c, sticker, plan)
+        c.showPage()
+    return (time.perf_counter() - start) / len(stickers)
+
+def benchmark_text_engines(count=500):
+    """Compare the Paragraph engine with the plain-text fast path on the default design."""
+    plain_plan = compile_layout(default_sticker_design())
+    rich_plan = plain_plan._replace(product_ops=tuple(op._replace(rich=True) for op in plain_plan.product_ops))
+    stickers = sample_stickers(count)
+    return {
+        'stickers': count,
+        'paragraph_ms': time_per_sticker(rich_plan, stickers) * 1000,
+        'plain_ms': time_per_sticker(plain_plan, stickers) * 1000,
+    }
+
+def benchmark_parallel_render(labels, process_counts, root_path, products=20, image_dpi=300, printer_type='normal'):
+    """
+    Time a job of `labels` stickers (spread over `products` distinct stickers) rendered in one process and
+    sharded over each process count, with output sizes. Pool start-up is excluded by warming each pool first.
+    Also times stitching alone, on shards rendered in this process, which no number of processes speeds up.
+    """
+    import shutil
+    import tempfile
+    from app.parallel_render import (create_sticker_pdf_parallel, get_render_pool, shard_size_for, split_runs,
+                                     stitch_shards)
+
+    design = default_sticker_design()
+    design.printer_type = printer_type
+    plan = compile_layout(design)
+    layout = (plan, StoreLayer(plan, None, os.path.join(root_path, 'static'), image_dpi))
+    per_product, extra = divmod(labels, products)
+    runs = [StickerRun(sticker, per_product + (i < extra)) for i, sticker in enumerate(sample_stickers(products))]
+
+    output = io.BytesIO()
+    start = time.perf_counter()
+    create_sticker_pdf(runs, output, layout)
+    serial = time.perf_counter() - start
+    serial_bytes = len(output.getvalue())
+
+    shard_dir = tempfile.mkdtemp(prefix='bench-shards-')
+    try:
+        paths = []
+        for index, shard in enumerate(split_runs(runs, shard_size_for(plan, labels, max(process_counts), 1))):
+            paths.append(os.path.join(shard_dir, f'{index:05d}.pdf'))
+            create_sticker_pdf(shard, paths[-1], layout)
+        start = time.perf_counter()
+        stitch_shards(paths, io.BytesIO())
+        stitch = time.perf_counter() - start
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    results = []
+    for processes in process_counts:
+        pool = get_render_pool(processes, root_path)
+        list(pool.map(int, range(processes)))
+        output = io.BytesIO()
+        start = time.perf_counter()
+        create_sticker_pdf_parallel(runs, output, layout, processes, root_path)
+        elapsed = time.perf_counter() - start
+        results.append({'processes': processes, 'seconds': elapsed, 'speedup': serial / elapsed,
+                        'bytes': len(output.getvalue())})
+    return {'labels': labels, 'cpu_count': os.cpu_count(), 'serial_seconds': serial, 'serial_bytes': serial_bytes,
+            'stitch_seconds': stitch, 'parallel': results}
+
+SampleProduct = namedtuple('SampleProduct', ['id', 'name', 'category_id', 'net_weight', 'rate', 'shelf_life'])
+SampleCategory = namedtuple('SampleCategory', ['id', 'name'])
+
+PRODUCT_NAME_WORDS = ('banana', 'jackfruit', 'tapioca', 'chips', 'halwa', 'pickle', 'mango', 'lime', 'garlic', 'ginger',
+                      'coconut', 'jaggery', 'masala', 'spicy', 'salted', 'sweet', 'roasted', 'cashew', 'peanut', 'murukku',
+                      'mixture', 'chakka', 'unniyappam', 'achappam', 'kuzhalappam', 'pepper', 'cardamom', 'tea', 'coffee', 'honey')
+
+def sample_products(count, categories=50, seed=1):
+    """Product rows with realistic 2-4 word names and net weights, for the autocomplete benchmark."""
+    rng = random.Random(seed)
+    return [
+        SampleProduct(i, ' '.join(rng.choice(PRODUCT_NAME_WORDS).capitalize() for _ in range(rng.randint(2, 4))) + f' {i}',
+                      rng.randrange(categories) + 1, f'{rng.choice((100, 200, 250, 500, 1000))}', Decimal(rng.randint(20, 900)),
+                      rng.choice((30, 60, 90, 180)))
+        for i in range(1, count + 1)
+    ]
+
+def benchmark_autocomplete(products=10000, lookups=2000):
+    """Memory held by an AutocompleteIndex of `products` products, and its average typeahead lookup time."""
+    from app.autocomplete import AutocompleteIndex
+
+    rows = sample_products(products)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    index = AutocompleteIndex()
+    for category_id in range(1, 51):
+        index._put_category(SampleCategory(category_id, f'Category {category_id}'))
+    for row in rows:
+        index._put_product(row)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    rng = random.Random(2)
+    terms = [rng.choice(PRODUCT_NAME_WORDS)[:rng.randint(1, 6)] for _ in range(lookups)]
+    start = time.perf_counter()
+    for term in terms:
+        index.products.search(term, 20)
+    elapsed = time.perf_counter() - start
+    return {
+        'products': products,
+        'trigrams': len(index.products.postings),
+        'memory_bytes': memory,
+        'bytes_per_10k': memory * 10000 // products,
+        'lookup_ms': elapsed / lookups * 1000
+    }
+
+# Listing endpoints and the most SQL statements each may issue, however many rows the page or the
+# catalog holds. Each includes the current user lookup, pages the store info for the header, and
+# typeahead a full autocomplete index sync.
+LISTING_QUERY_BUDGETS = {
+    '/products': 4,
+    '/products?q=a': 7,
+    '/search_products?q=a': 7,
+    '/categories': 4,
+    '/search_categories?q=a': 7,
+    '/print_jobs': 4,
+    '/catalog': 3,
+}
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements run on the app's engine inside the block, in the list it yields."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+def listing_query_counts(app, user):
+    """Request each listing endpoint as user and count its statements against LISTING_QUERY_BUDGETS. Read only."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    results = []
+    # Requests are made from a thread with no app context, so each gets its own session and current
+    # user as in production rather than sharing the caller's
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # One-off startup checks run on the first request
+        executor.submit(client.get, '/').result()
+        for path, budget in LISTING_QUERY_BUDGETS.items():
+            with count_queries() as statements:
+                response = executor.submit(client.get, path).result()
+            results.append({'path': path, 'status': response.status_code, 'queries': len(statements), 'budget': budget})
+    return results
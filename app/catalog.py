@@ -0,0 +1,85 @@
+"""
+Catalog of printable products for the print station browser, which keeps its own copy and filters it
+locally. A snapshot lists every product as compact rows; a delta (?since=<version>) lists only the
+products changed since that version and the ids of those deleted, from ProductTombstone rows. Both
+carry an ETag of the catalog state, so an unchanged catalog is answered with 304 Not Modified.
+"""
+import hashlib
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, or_
+from app import db
+from app.models import Product, ProductCategory, ProductTombstone
+
+CATALOG_FIELDS = ('id', 'name', 'category', 'net_weight', 'rate', 'shelf_life')
+
+# Rows committed just before a version was taken can carry an earlier timestamp, so deltas overlap
+SINCE_OVERLAP = timedelta(seconds=30)
+
+# Snapshot bodies by ETag; only the current one is kept
+_snapshots = {}
+
+class CatalogState:
+    """The newest change times and product count, which change whenever the catalog does."""
+    def __init__(self, product_updated, product_count, category_updated, deleted):
+        times = [t for t in (product_updated, category_updated, deleted) if t is not None]
+        self.version = max(times).isoformat() if times else datetime.utcnow().isoformat()
+        key = f'{product_updated}|{product_count}|{category_updated}|{deleted}'
+        self.etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+def catalog_state():
+    row = db.session.query(
+        Product.query.with_entities(func.max(Product.updated_at)).scalar_subquery(),
+        Product.query.with_entities(func.count(Product.id)).scalar_subquery(),
+        ProductCategory.query.with_entities(func.max(ProductCategory.updated_at)).scalar_subquery(),
+        ProductTombstone.query.with_entities(func.max(ProductTombstone.deleted_at)).scalar_subquery(),
+    ).one()
+    return CatalogState(*row)
+
+def parse_version(value):
+    """The datetime of a version string from an earlier response; raises ValueError if it is not one."""
+    return datetime.fromisoformat(value)
+
+def _product_rows(query):
+    rows = (query.join(ProductCategory, Product.category_id == ProductCategory.id)
+            .with_entities(Product.id, Product.name, ProductCategory.name, Product.net_weight,
+                           Product.rate, Product.shelf_life)
+            .order_by(Product.name, Product.id))
+    return [[product_id, name, category, net_weight, str(rate), shelf_life]
+            for product_id, name, category, net_weight, rate, shelf_life in rows]
+
+def catalog_snapshot(state):
+    """Every product, as {'version', 'full', 'fields', 'products'} with one list per product in field order."""
+    snapshot = _snapshots.get(state.etag)
+    if snapshot is None:
+        _snapshots.clear()
+        snapshot = _snapshots[state.etag] = {
+            'version': state.version,
+            'full': True,
+            'fields': CATALOG_FIELDS,
+            'products': _product_rows(Product.query),
+        }
+    return snapshot
+
+def catalog_changes(state, since):
+    """
+    Products changed, or moved to a renamed category, since the given version, plus the ids deleted since.
+    Versions older than CATALOG_TOMBSTONE_TTL may have missed deletions, so they get the full snapshot.
+    """
+    if since < datetime.utcnow() - timedelta(seconds=current_app.config['CATALOG_TOMBSTONE_TTL']):
+        return catalog_snapshot(state)
+    since = since - SINCE_OVERLAP
+    products = _product_rows(Product.query.filter(or_(Product.updated_at >= since,
+                                                      ProductCategory.updated_at >= since)))
+    changed = {row[0] for row in products}
+    deleted = (ProductTombstone.query
+               .filter(ProductTombstone.deleted_at >= since)
+               .with_entities(ProductTombstone.product_id)
+               .distinct())
+    return {
+        'version': state.version,
+        'full': False,
+        'fields': CATALOG_FIELDS,
+        'products': products,
+        'deleted': sorted(product_id for product_id, in deleted if product_id not in changed),
+    }
@@ -0,0 +1,42 @@
+"""
+A stand-in for a raw TCP label printer, for testing direct printing without hardware.
+Everything received on a connection is appended to one file per connection.
+"""
+import os
+import socket
+import threading
+
+def _receive(conn, path, drop_after):
+    received = 0
+    # Unbuffered, so the file always shows exactly what the printer has read, even while the job is running
+    with conn, open(path, 'wb', buffering=0) as f:
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            if drop_after and received + len(data) >= drop_after:
+                # Simulate the printer going away part way through a job
+                f.write(data[:drop_after - received])
+                break
+            f.write(data)
+            received += len(data)
+
+def serve_fake_printer(port, out_dir, host='0.0.0.0', drop_after=0, stop_event=None):
+    """Accept connections until stop_event is set, saving each one to out_dir/job-<n>.bin."""
+    os.makedirs(out_dir, exist_ok=True)
+    server = socket.create_server((host, port), reuse_port=False)
+    server.settimeout(0.5)
+    count = 0
+    try:
+        while stop_event is None or not stop_event.is_set():
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            count += 1
+            path = os.path.join(out_dir, f'job-{count}.bin')
+            threading.Thread(target=_receive, args=(conn, path, drop_after), daemon=True).start()
+            # Only the first connection is cut short, so a retry gets through
+            drop_after = 0
+    finally:
+        server.close()
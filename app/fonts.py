@@ -0,0 +1,34 @@
+"""
+Font registry for sticker rendering.
+The shipped RobotoCondensed faces are parsed once per process from create_app, so rendering
+a PDF never touches the TTF files.
+"""
+import os
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.fonts import addMapping
+
+REGULAR_FONT = 'RobotoCondensed'
+SEMIBOLD_FONT = 'RobotoCondensed-SemiBold'
+BOLD_FONT = 'RobotoCondensed-Bold'
+
+# Registered face name -> file in static/fonts
+FONT_FILES = {
+    REGULAR_FONT: 'RobotoCondensed-Regular.ttf',
+    SEMIBOLD_FONT: 'RobotoCondensed-SemiBold.ttf',
+    BOLD_FONT: 'RobotoCondensed-Bold.ttf',
+}
+
+def register_fonts(root_path):
+    """Parse and register the sticker fonts once; safe to call again (e.g. in worker processes)."""
+    registered = set(pdfmetrics.getRegisteredFontNames())
+    fonts_dir = os.path.join(root_path, 'static', 'fonts')
+    for font_name, filename in FONT_FILES.items():
+        if font_name not in registered:
+            pdfmetrics.registerFont(TTFont(font_name, os.path.join(fonts_dir, filename)))
+
+    # Let <b> in rich (Paragraph) fields resolve to the real bold face
+    addMapping(REGULAR_FONT, 0, 0, REGULAR_FONT)
+    addMapping(REGULAR_FONT, 1, 0, BOLD_FONT)
+    addMapping(REGULAR_FONT, 0, 1, REGULAR_FONT)
+    addMapping(REGULAR_FONT, 1, 1, BOLD_FONT)
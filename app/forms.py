@@ -87,6 +87,16 @@ class StoreInfoForm(FlaskForm):
     logo = FileField('Store Logo', validators=[Optional()])
     submit = SubmitField('Save Store Info')
 
+class PrinterForm(FlaskForm):
+    name = StringField('Printer Name', validators=[DataRequired(), Length(max=100)])
+    protocol = SelectField('Protocol', choices=[('raw', 'Raw TCP (port 9100)'), ('ipp', 'IPP')], validators=[DataRequired()])
+    host = StringField('Host or IP Address', validators=[DataRequired(), Length(max=255)])
+    port = IntegerField('Port', validators=[DataRequired(), NumberRange(min=1, max=65535)], default=9100)
+    path = StringField('IPP Path', validators=[Optional(), Length(max=255)], default='/ipp/print')
+    output_format = SelectField('Send As', choices=[('pdf', 'PDF'), ('zpl', 'ZPL (Zebra)'), ('tspl', 'TSPL (TSC)')], validators=[DataRequired()])
+    is_default = BooleanField('Default Printer')
+    submit = SubmitField('Add Printer')
+
 class StickerDesignForm(FlaskForm):
     print_nutritional_heading = BooleanField('Print Nutritional Facts Heading')
     print_allergen_heading = BooleanField('Print Allergen Information Heading')
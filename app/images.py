@@ -0,0 +1,84 @@
+"""
+Image pipeline for sticker artwork.
+Logo and background images are scaled down to the size they are printed at (at STICKER_IMAGE_DPI),
+written next to the upload under `scaled/`, and kept in memory keyed by source path and mtime.
+"""
+import io
+import os
+import threading
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+
+# (source path, source mtime, width pt, height pt, dpi) -> PreparedImage
+_prepared_images = {}
+# Held while the cache is scanned or changed; request, render and dispatch threads all use it
+_prepared_images_lock = threading.Lock()
+
+class PreparedImage:
+    """Print-ready image bytes plus the pixel size of the original upload."""
+    def __init__(self, path, data, source_size):
+        self.path = path
+        self.data = data
+        self.source_size = source_size
+
+    @property
+    def aspect(self):
+        width, height = self.source_size
+        return height / float(width)
+
+    def reader(self):
+        # A fresh reader per PDF: readers hold file-like state and are not safe to share between threads
+        return ImageReader(io.BytesIO(self.data))
+
+def points_to_pixels(points, dpi):
+    return max(1, int(round(points / 72.0 * dpi)))
+
+def scaled_image_path(source_path, width_px, height_px):
+    stem, ext = os.path.splitext(os.path.basename(source_path))
+    ext = '.jpg' if ext.lower() in ('.jpg', '.jpeg') else '.png'
+    return os.path.join(os.path.dirname(source_path), 'scaled', f'{stem}-{width_px}x{height_px}{ext}')
+
+def _scale_image(source_path, width_pt, height_pt, dpi):
+    with Image.open(source_path) as img:
+        source_size = img.size
+        width_px = points_to_pixels(width_pt, dpi)
+        if height_pt is None:
+            height_pt = width_pt * source_size[1] / float(source_size[0])
+        height_px = points_to_pixels(height_pt, dpi)
+
+        # Never scale up: an image already at or below print resolution is embedded as uploaded
+        if source_size[0] <= width_px and source_size[1] <= height_px:
+            with open(source_path, 'rb') as f:
+                return PreparedImage(source_path, f.read(), source_size)
+
+        scaled_path = scaled_image_path(source_path, width_px, height_px)
+        if not os.path.exists(scaled_path) or os.path.getmtime(scaled_path) < os.path.getmtime(source_path):
+            os.makedirs(os.path.dirname(scaled_path), exist_ok=True)
+            scaled = img.convert('RGBA' if scaled_path.endswith('.png') else 'RGB').resize((width_px, height_px), Image.LANCZOS)
+            # Write under a temporary name so other workers never read a half-written file
+            tmp_path = f'{scaled_path}.{os.getpid()}.tmp'
+            if scaled_path.endswith('.png'):
+                scaled.save(tmp_path, format='PNG', optimize=True)
+            else:
+                scaled.save(tmp_path, format='JPEG', quality=90)
+            os.replace(tmp_path, scaled_path)
+
+    with open(scaled_path, 'rb') as f:
+        return PreparedImage(scaled_path, f.read(), source_size)
+
+def prepare_image(source_path, width_pt, height_pt, dpi):
+    """
+    Return a PreparedImage for printing source_path at width_pt x height_pt points.
+    Pass height_pt=None to keep the aspect ratio. Cached by path and mtime, so a replaced upload is picked up.
+    """
+    mtime = os.path.getmtime(source_path)
+    key = (source_path, mtime, width_pt, height_pt, dpi)
+    prepared = _prepared_images.get(key)
+    if prepared is None:
+        prepared = _scale_image(source_path, width_pt, height_pt, dpi)
+        with _prepared_images_lock:
+            # Drop entries for older versions of the same file
+            for stale_key in [k for k in _prepared_images if k[0] == source_path and k[1] != mtime]:
+                del _prepared_images[stale_key]
+            _prepared_images[key] = prepared
+    return prepared
@@ -0,0 +1,104 @@
+"""
+Golden output files for the ZPL and TSPL backends. A fixed design, store info and set of runs (with
+printer-side copies) are rendered at a fixed DPI, in full and as the payload a dispatch retry would
+resend from a later label, and compared byte for byte with the files saved in app/golden.
+`flask check-label-golden` runs the comparison; `--update` rewrites the files after an intended change.
+"""
+import difflib
+import os
+from datetime import date, datetime, timedelta
+
+from app.bench import default_sticker_design
+from app.label_printer import LABEL_LANGUAGES, LABEL_PROGRAMS, label_offsets, store_layer_bitmap
+from app.models import StoreInfo
+from app.print_dispatch import resume_payload
+from app.sticker import Sticker, StickerRun, StoreLayer, compile_layout
+
+GOLDEN_DPI = 203
+
+# Labels each resume case restarts from (0-based, counting one label per distinct sticker)
+GOLDEN_RESUME_LABELS = (1, 2)
+
+def golden_layout(static_root):
+    """The default label design and a store without images, with fixed versions so the output never moves."""
+    design = default_sticker_design()
+    design.id, design.updated_at, design.printer_type = 1, datetime(2024, 1, 1), 'label'
+    store_info = StoreInfo(id=1, updated_at=datetime(2024, 1, 1), name='Golden Bakery & Co',
+                           address='12 Market Road, Kochi 682001', phone_number='9876543210',
+                           gst_number='32ABCDE1234F1Z5', fssai_number='11223344556677', email='orders@example.com')
+    plan = compile_layout(design)
+    return plan, StoreLayer(plan, store_info, static_root, GOLDEN_DPI)
+
+def golden_runs():
+    """Three distinct stickers printed 1, 3 and 12 times, covering escaping, the rupee sign and wrapping."""
+    mfg_date = date(2024, 1, 1)
+    products = [
+        ('Banana Chips & Jaggery <Classic>', '120.00', '200', 'Raw banana, coconut oil, jaggery, salt'),
+        ('Tapioca ^Chips~ "Hot"', '45.50', '100', 'Tapioca, sunflower oil, chilli powder, salt_and_spice'),
+        ('Murukku', '80.00', '250', 'Rice flour, urad dal flour, sesame seeds, cumin, butter, salt, asafoetida, '
+                                    'curry leaves, coconut oil'),
+    ]
+    runs = []
+    for index, (name, rate, net_weight, ingredients) in enumerate(products):
+        sticker = Sticker(
+            product_name=name,
+            rate=rate,
+            mfg_date=mfg_date,
+            exp_date=mfg_date + timedelta(days=90),
+            net_weight=net_weight,
+            ingredients=ingredients,
+            nutritional_facts='Energy Value:    540 kcal\nProtein:         2 g\nTotal Fat:       34 g',
+            batch_number=f'BGLD{index + 1:08d}',
+            allergen_information='Processed in a facility that also handles tree nuts.'
+        )
+        runs.append(StickerRun(sticker, (1, 3, 12)[index]))
+    return runs
+
+def golden_outputs(root_path):
+    """Return {file name: bytes} for every golden file, rendered from the fixed design and runs."""
+    plan, store_layer = golden_layout(os.path.join(root_path, 'static'))
+    runs = golden_runs()
+    # Rasterised directly rather than through the store bitmap cache, which holds the live design
+    bitmap = store_layer_bitmap(plan, store_layer, GOLDEN_DPI, os.path.join(root_path, 'static', 'fonts'))
+    outputs = {}
+    for language in LABEL_LANGUAGES:
+        program = LABEL_PROGRAMS[language](runs, plan, bitmap, GOLDEN_DPI)
+        outputs[f'stickers.{language}'] = program
+        _, offsets = label_offsets(program, language)
+        for label in GOLDEN_RESUME_LABELS:
+            # Part way into the label, as a connection dropped mid-send would leave it
+            payload, _ = resume_payload(program, language, offsets[label] + 5)
+            outputs[f'stickers-resume-{label}.{language}'] = payload
+    return outputs
+
+def golden_diff(expected, actual, name, context=40):
+    """The first lines of a unified diff between two outputs; binary parts are shown as Latin-1."""
+    lines = difflib.unified_diff(expected.decode('latin-1').splitlines(), actual.decode('latin-1').splitlines(),
+                                 f'golden/{name}', name, lineterm='')
+    return [line[:200] for _, line in zip(range(context), lines)]
+
+def check_label_goldens(root_path, update=False):
+    """
+    Compare the rendered outputs with the golden files. Returns (name, status, diff lines) for each, where
+    status is 'ok', 'differs', 'missing' or, with update=True, 'written' for files that were rewritten.
+    """
+    golden_dir = os.path.join(root_path, 'golden')
+    results = []
+    for name, actual in sorted(golden_outputs(root_path).items()):
+        path = os.path.join(golden_dir, name)
+        expected = None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                expected = f.read()
+        if expected == actual:
+            results.append((name, 'ok', []))
+        elif update:
+            os.makedirs(golden_dir, exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(actual)
+            results.append((name, 'written', []))
+        elif expected is None:
+            results.append((name, 'missing', []))
+        else:
+            results.append((name, 'differs', golden_diff(expected, actual, name)))
+    return results
@@ -0,0 +1,221 @@
+"""
+Native label-printer output (ZPL for Zebra, TSPL for TSC and compatibles) as an alternative to PDF.
+The static store layer is rasterised once per job and downloaded to printer memory as a stored
+graphic; each distinct sticker is then sent as its variable text fields only, positioned from the
+same LayoutPlan as the PDF renderer, and the printer makes the copies. Output is deterministic for
+a given design, store info, runs and DPI, so it can be compared byte for byte against saved files.
+"""
+import base64
+import binascii
+import html
+import io
+import os
+import re
+import zlib
+from functools import lru_cache
+from flask import current_app
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib.units import mm
+
+from app.fonts import FONT_FILES
+from app.artifacts import artifact_id_for, get_artifact, write_artifact
+from app.sticker import PRODUCT_FIELD_TEXT, load_sticker_layout, wrap_plain_text
+
+LABEL_LANGUAGES = ('zpl', 'tspl')
+
+# Name of the store layer graphic in printer RAM; it is replaced by every job
+STORE_GRAPHIC = 'STORE'
+
+# Resident printer fonts have no rupee sign
+PRINTER_TEXT_SUBSTITUTIONS = {'₹': 'Rs.'}
+
+# TSPL places text by its top edge; this is the ascent of the resident font as a fraction of its size
+TSPL_FONT_ASCENT = 0.8
+
+_markup = re.compile(r'<[^>]+>')
+
+# Rasterised store layers by (plan key, store layer key, dpi)
+_store_bitmaps = {}
+
+def dots(points, dpi):
+    return int(round(points * dpi / 72.0))
+
+def printer_text(text, rich=False):
+    if rich:
+        text = html.unescape(_markup.sub('', text))
+    for char, replacement in PRINTER_TEXT_SUBSTITUTIONS.items():
+        text = text.replace(char, replacement)
+    return text
+
+def text_lines(op, text):
+    """
+    Yield (line, x, baseline, font_size, font_name) in PDF points for one draw op, with the same
+    wrapping and line spacing as the plain-text PDF path.
+    """
+    if op.kind == 'nutritional_heading':
+        first, second = text.split('\n')
+        yield first, op.x, op.y, op.font_size, op.font_name
+        yield second, op.x, op.y - op.font_size, op.font_size - 1.5, op.font_name
+        return
+
+    paragraphs = text if op.kind == 'lines' else [text]
+    for index, paragraph in enumerate(paragraphs):
+        top = op.y - index * op.font_size * 1.15
+        paragraph = printer_text(paragraph, op.rich)
+        for line_index, line in enumerate(wrap_plain_text(paragraph, op.max_width, op.font_size, op.font_name)):
+            yield line, op.x, top - op.font_size - line_index * (op.font_size + 0.7), op.font_size, op.font_name
+
+def sticker_lines(sticker, plan):
+    for op in plan.product_ops:
+        text = op.text if op.field is None else PRODUCT_FIELD_TEXT[op.field](sticker)
+        yield from text_lines(op, text)
+
+@lru_cache(maxsize=64)
+def _truetype(path, size):
+    return ImageFont.truetype(path, size)
+
+def _paste_image(canvas_image, prepared, x, y, width, height, dpi):
+    """Paste a PreparedImage with its bottom-left corner at (x, y) PDF points, flattened onto white."""
+    with Image.open(io.BytesIO(prepared.data)) as source:
+        image = source.convert('RGBA')
+    flattened = Image.new('RGBA', image.size, (255, 255, 255, 255))
+    flattened.alpha_composite(image)
+    size = (max(1, dots(width, dpi)), max(1, dots(height, dpi)))
+    grey = flattened.convert('L').resize(size, Image.LANCZOS)
+    canvas_image.paste(grey, (dots(x, dpi), canvas_image.height - dots(y, dpi) - size[1]))
+
+def store_layer_bitmap(plan, store_layer, dpi, fonts_dir):
+    """
+    Rasterise the store layer to a 1-bit image (black = 0), its width padded to whole bytes.
+    Artwork is dithered; text is drawn afterwards without anti-aliasing so it stays crisp.
+    """
+    width = -(-dots(plan.width, dpi) // 8) * 8
+    height = dots(plan.height, dpi)
+    image = Image.new('L', (width, height), 255)
+    if store_layer.bg_image:
+        margin = store_layer.margin
+        _paste_image(image, store_layer.bg_image, margin, margin, plan.width - 2*margin, plan.height - 2*margin, dpi)
+    if store_layer.logo:
+        logo, logo_x, logo_y, logo_width, logo_height = store_layer.logo
+        _paste_image(image, logo, logo_x, logo_y, logo_width, logo_height, dpi)
+
+    image = image.convert('1')
+    draw = ImageDraw.Draw(image)
+    draw.fontmode = '1'
+    for op, text in store_layer.texts:
+        for line, x, baseline, font_size, font_name in text_lines(op, text):
+            font = _truetype(os.path.join(fonts_dir, FONT_FILES[font_name]), max(1, dots(font_size, dpi)))
+            draw.text((dots(x, dpi), height - dots(baseline, dpi)), line, font=font, fill=0, anchor='ls')
+    return image
+
+def cached_store_layer_bitmap(plan, store_layer, dpi, fonts_dir):
+    """store_layer_bitmap, reused across jobs while the design and store info are unchanged."""
+    key = (plan.key, store_layer.key, dpi)
+    bitmap = _store_bitmaps.get(key)
+    if bitmap is None:
+        # Only the current design and store info are ever needed
+        _store_bitmaps.clear()
+        bitmap = _store_bitmaps[key] = store_layer_bitmap(plan, store_layer, dpi, fonts_dir)
+    return bitmap
+
+def _zpl_field(text):
+    # Used with ^FH_: control characters in the data are sent as hex escapes
+    return text.replace('_', '_5F').replace('^', '_5E').replace('~', '_7E')
+
+def zpl_program(runs, plan, bitmap, dpi):
+    """ZPL II: download the store graphic once, then one label format per distinct sticker with ^PQ copies."""
+    row_bytes = bitmap.width // 8
+    # ZPL prints 1 bits; PIL packs white as 1
+    data = bytes(byte ^ 0xFF for byte in bitmap.tobytes())
+    encoded = base64.b64encode(zlib.compress(data, 9))
+    crc = binascii.crc_hqx(encoded, 0)
+    out = [
+        f'~DGR:{STORE_GRAPHIC}.GRF,{len(data)},{row_bytes},:Z64:{encoded.decode("ascii")}:{crc:04X}',
+    ]
+    for sticker, count in runs:
+        out.append(f'^XA^PW{bitmap.width}^LL{bitmap.height}^LH0,0^CI28')
+        out.append(f'^FO0,0^XGR:{STORE_GRAPHIC}.GRF,1,1^FS')
+        for line, x, baseline, font_size, font_name in sticker_lines(sticker, plan):
+            out.append(f'^FT{dots(x, dpi)},{bitmap.height - dots(baseline, dpi)}^A0N,{dots(font_size, dpi)}'
+                       f'^FH_^FD{_zpl_field(line)}^FS')
+        out.append(f'^PQ{count},0,1,Y')
+        out.append('^XZ')
+    return ('\n'.join(out) + '\n').encode('utf-8')
+
+def _tspl_string(text):
+    return '"' + text.replace('"', '\\["]') + '"'
+
+def tspl_program(runs, plan, bitmap, dpi):
+    """TSPL: download the store layer as a BMP once, then CLS/PUTBMP/TEXT/PRINT 1,<copies> per distinct sticker."""
+    bmp = io.BytesIO()
+    bitmap.save(bmp, format='BMP')
+    bmp = bmp.getvalue()
+    out = io.BytesIO()
+
+    def command(line):
+        out.write(line.encode('utf-8') + b'\r\n')
+
+    command(f'SIZE {plan.width / mm:.1f} mm,{plan.height / mm:.1f} mm')
+    command('GAP 2 mm,0 mm')
+    command('DIRECTION 1')
+    command('CODEPAGE UTF-8')
+    out.write(f'DOWNLOAD "{STORE_GRAPHIC}.BMP",{len(bmp)},'.encode('ascii') + bmp + b'\r\n')
+    for sticker, count in runs:
+        command('CLS')
+        command(f'PUTBMP 0,0,"{STORE_GRAPHIC}.BMP"')
+        for line, x, baseline, font_size, font_name in sticker_lines(sticker, plan):
+            top = bitmap.height - dots(baseline + font_size * TSPL_FONT_ASCENT, dpi)
+            # Font "0" is the resident scalable font, sized in whole points
+            size = max(1, int(round(font_size)))
+            command(f'TEXT {dots(x, dpi)},{max(0, top)},"0",0,{size},{size},{_tspl_string(line)}')
+        command(f'PRINT 1,{count}')
+    return out.getvalue()
+
+_tspl_download = re.compile(rb'DOWNLOAD "[^"]*",(\d+),')
+
+def label_offsets(program, language):
+    """
+    Return (header_end, offsets): the end of the store graphic download and the byte offset at which
+    each label starts. Sending program[:header_end] + program[offset:] reprints from that label on.
+    """
+    if language == 'zpl':
+        marker, header_end = b'^XA', program.find(b'^XA')
+    else:
+        download = _tspl_download.search(program)
+        marker, header_end = b'CLS\r\n', download.end() + int(download.group(1)) + 2
+    offsets = []
+    offset = program.find(marker, header_end)
+    while offset != -1:
+        offsets.append(offset)
+        offset = program.find(marker, offset + 1)
+    return header_end, offsets
+
+LABEL_PROGRAMS = {
+    'zpl': zpl_program,
+    'tspl': tspl_program,
+}
+
+def create_label_program(runs, language, layout, dpi, fonts_dir):
+    """Return the printer program for these runs as bytes."""
+    plan, store_layer = layout
+    if plan.printer_type != 'label':
+        raise ValueError('Printer command output needs a sticker design for a label printer')
+    bitmap = cached_store_layer_bitmap(plan, store_layer, dpi, fonts_dir)
+    return LABEL_PROGRAMS[language](runs, plan, bitmap, dpi)
+
+def create_label_output(runs, language, progress=None, layout=None):
+    """Return the artifact id of the printer program for these runs, building it only when not already cached."""
+    if language not in LABEL_LANGUAGES:
+        raise ValueError(f'Unknown printer language: {language}')
+    layout = layout or load_sticker_layout()
+    plan, store_layer = layout
+    dpi = current_app.config['LABEL_PRINTER_DPI']
+    artifact_id = artifact_id_for(language, dpi, plan.key, store_layer.key,
+                                  [(sticker.key(), count) for sticker, count in runs])
+    if get_artifact(artifact_id, language) is None:
+        program = create_label_program(runs, language, layout, dpi, os.path.join(current_app.root_path, 'static', 'fonts'))
+        with write_artifact(artifact_id, language) as f:
+            f.write(program)
+    if progress:
+        progress(sum(count for _, count in runs))
+    return artifact_id
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 main = Blueprint('main', __name__)
 
-from . import routes, categories, products, print_jobs, users, analytics, print_routes, backups, settings
+from . import routes, categories, products, print_jobs, users, analytics, print_routes, backups, settings, printers
@@ -1,11 +1,10 @@
 from flask import render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required
-from flask_paginate import Pagination, get_page_parameter
-from sqlalchemy import desc
-
 from app import db
 from app.models import ProductCategory
+from app.pagination import keyset_paginate
 from app.forms import CategoryForm
+from app.autocomplete import autocomplete_categories, refresh_autocomplete
 
 from . import main
 
@@ -19,25 +18,14 @@ def list_categories():
     View function for listing all product categories.
     Orders by last updated first.
     """
-    page = request.args.get(get_page_parameter(), type=int, default=1)
-    categories_pagination = ProductCategory.query.order_by(
-        desc(ProductCategory.updated_at)
-    ).paginate(
-        page=page,
-        per_page=PER_PAGE,
-        error_out=False
+    categories_pagination = keyset_paginate(
+        ProductCategory.query, ProductCategory.updated_at, ProductCategory.id, PER_PAGE, 'product_category'
     )
     
     return render_template(
         'categories.html',
         categories=categories_pagination.items,
-        pagination=Pagination(
-            page=page,
-            total=categories_pagination.total,
-            search=False,
-            per_page=PER_PAGE,
-            css_framework='bootstrap4'
-        )
+        pagination=categories_pagination
     )
 
 @main.route('/category/new', methods=['GET', 'POST'])
@@ -52,6 +40,7 @@ def new_category():
             category = ProductCategory(name=form.name.data)
             db.session.add(category)
             db.session.commit()
+            refresh_autocomplete()
             flash('Category has been created!', 'success')
             return redirect(url_for('main.list_categories'))
         except Exception as e:
@@ -72,6 +61,7 @@ def edit_category(category_id):
         try:
             category.name = form.name.data
             db.session.commit()
+            refresh_autocomplete()
             flash('Category has been updated!', 'success')
             return redirect(url_for('main.list_categories'))
         except Exception as e:
@@ -96,6 +86,7 @@ def delete_category(category_id):
         
         db.session.delete(category)
         db.session.commit()
+        refresh_autocomplete()
         
         flash(f'Category and {products_count} associated products have been deleted!', 'success')
     except Exception as e:
@@ -114,15 +105,7 @@ def search_categories():
     """
     search_term = request.args.get('q')
     if search_term:
-        categories = ProductCategory.query.filter(
-            ProductCategory.name.ilike(f'%{search_term}%')
-        ).order_by(ProductCategory.name).all()
-        
-        return jsonify([{
-            'id': c.id,
-            'name': c.name,
-            'product_count': len(c.products)
-        } for c in categories])
+        return jsonify(autocomplete_categories(search_term))
     return jsonify([])
 
 @main.route('/add_category', methods=['POST'])
@@ -150,6 +133,7 @@ def add_category():
         category = ProductCategory(name=category_name)
         db.session.add(category)
         db.session.commit()
+        refresh_autocomplete()
         
         return jsonify({
             'id': category.id,
@@ -1,10 +1,10 @@
 from flask import render_template, request, flash, redirect, url_for
 from flask_login import login_required, current_user
-from flask_paginate import Pagination, get_page_parameter
-from sqlalchemy import desc
 from decimal import Decimal
 
+from app import db
 from app.models import PrintJob
+from app.pagination import keyset_paginate
 from .decorators import store_admin_required
 
 from . import main
@@ -22,21 +22,17 @@ def print_jobs():
     """
     try:
         success_message = request.args.get('success_message')
-        page = request.args.get(get_page_parameter(), type=int, default=1)
-        
         # Filter query based on user role
-        query = PrintJob.query
+        # The page shows each job's product and user; load them in the same query
+        query = PrintJob.query.options(db.joinedload(PrintJob.product), db.joinedload(PrintJob.user))
         if current_user.role != 'store_admin':
             query = query.filter_by(user_id=current_user.id)
-        
-        # Order by print date, most recent first
-        print_jobs_pagination = query.order_by(
-            desc(PrintJob.print_date)
-        ).paginate(
-            page=page,
-            per_page=PER_PAGE,
-            error_out=False
-        )
+            count_key, table = f'print_job:user:{current_user.id}', None
+        else:
+            count_key, table = 'print_job', 'print_job'
+
+        # Most recent first, continuing from the ?after=/?before= cursor
+        print_jobs_pagination = keyset_paginate(query, PrintJob.print_date, PrintJob.id, PER_PAGE, count_key, table)
 
         # Calculate values for each print job
         jobs_with_values = []
@@ -53,13 +49,7 @@ def print_jobs():
         return render_template(
             'print_jobs.html',
             print_jobs=jobs_with_values,
-            pagination=Pagination(
-                page=page,
-                total=print_jobs_pagination.total,
-                search=False,
-                per_page=PER_PAGE,
-                css_framework='bootstrap4'
-            ),
+            pagination=print_jobs_pagination,
             success_message=success_message,
             is_admin=current_user.role == 'store_admin'
         )
@@ -1,15 +1,180 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, send_file, current_app
+from flask import render_template, redirect, url_for, flash, request, jsonify, send_file, current_app, Response, abort
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+import hashlib
+import json
 import os
 
 from app import db
-from app.models import Product, PrintJob
+from app.models import Product, PrintJob, RenderJob, StickerDesign, Printer, IdempotencyKey
 from app.forms import SingleProductPrintForm, PrintForm
-from app.sticker import Sticker, create_stickers_pdf
+from app.sticker import Sticker, StickerRun, iter_file_chunks
+from app.artifacts import ARTIFACT_ID_PATTERN, get_artifact
+from app.revisions import current_revisions
+from app.print_queue import OUTPUT_FORMATS, QueueFullError, batch_metrics, enqueue_render_job, render_output, start_render_workers
+from app.print_dispatch import start_dispatch_workers
 
 from . import main
-from .products import generate_batch_number
+from .products import allocate_batch_numbers, generate_batch_number
+from .decorators import store_admin_required
+
+# Response type and disposition of each output format
+OUTPUT_MIMETYPES = {
+    'pdf': ('application/pdf', 'inline'),
+    'zpl': ('application/vnd.zebra-zpl', 'attachment'),
+    'tspl': ('application/octet-stream', 'attachment'),
+}
+
+def wants_streamed_pdf():
+    """Print requests with ?stream=1 get the PDF in the response instead of a link to sticker_preview."""
+    return request.args.get('stream', '0').lower() in ('1', 'true', 'yes')
+
+def requested_output_format():
+    """
+    Output format from ?format= (pdf, zpl or tspl) and whether ?copies=printer asks for each distinct
+    sticker once with the copy counts left to the printer. With ?printer=<id> the output is sent to that
+    printer in the format it is set up for. Returns (format, printer_copies, printer, None), or
+    (None, None, None, error response) when the request is invalid for the current design.
+    """
+    printer = None
+    printer_id = request.args.get('printer', type=int)
+    if printer_id is not None:
+        printer = Printer.query.filter_by(id=printer_id, enabled=True).first()
+        if printer is None:
+            return None, None, None, (jsonify({'message': 'The selected printer is not available.'}), 400)
+        output_format = printer.output_format
+    else:
+        output_format = request.args.get('format', 'pdf').lower()
+    if output_format not in OUTPUT_FORMATS:
+        return None, None, None, (jsonify({'message': f'Unknown output format: {output_format}'}), 400)
+    printer_copies = output_format != 'pdf' or request.args.get('copies') == 'printer'
+    if printer_copies:
+        design = StickerDesign.query.first()
+        if not design or design.printer_type != 'label':
+            return None, None, None, (jsonify({'message': 'Printer-side copies are only available for label printer designs.'}), 400)
+    return output_format, printer_copies, printer, None
+
+def job_ticket_url(artifact_id, output_format, printer_copies):
+    if output_format == 'pdf' and printer_copies:
+        return url_for('main.sticker_ticket', artifact_id=artifact_id)
+    return None
+
+def output_url(artifact_id, output_format):
+    if output_format == 'pdf':
+        return url_for('main.sticker_preview', artifact_id=artifact_id)
+    return url_for('main.sticker_output', artifact_id=artifact_id, output_format=output_format)
+
+def artifact_gone_response():
+    response = jsonify({'message': 'The stickers for this request are no longer available. Please print again.'})
+    response.status_code = 410
+    return response
+
+def streamed_output_response(artifact_id, output_format='pdf', printer_copies=False):
+    """Stream a cached output artifact, or answer 410 Gone when it has already been evicted."""
+    path = get_artifact(artifact_id, output_format)
+    if path is None:
+        return artifact_gone_response()
+    # Opened right away so a later eviction cannot pull the file out from under the response
+    try:
+        output_file = open(path, 'rb')
+    except FileNotFoundError:
+        return artifact_gone_response()
+    size = os.fstat(output_file.fileno()).st_size
+    mimetype, disposition = OUTPUT_MIMETYPES[output_format]
+    headers = {'Content-Disposition': f'{disposition}; filename=stickers.{output_format}', 'Content-Length': str(size)}
+    ticket_url = job_ticket_url(artifact_id, output_format, printer_copies)
+    if ticket_url:
+        headers['X-Job-Ticket'] = ticket_url
+    return Response(iter_file_chunks(output_file), mimetype=mimetype, headers=headers)
+
+def enabled_printers():
+    return Printer.query.filter_by(enabled=True).order_by(Printer.name).all()
+
+def queue_full_response(error):
+    response = jsonify({'message': str(error)})
+    response.status_code = 429
+    response.headers['Retry-After'] = '5'
+    return response
+
+def render_job_response(job):
+    """202 with the job id and where to poll for it; the job must be committed already."""
+    # Worker threads start with the first print request, so CLI commands never spawn them
+    app = current_app._get_current_object()
+    start_render_workers(app)
+    if job.printer_id is not None:
+        start_dispatch_workers(app)
+    response = jsonify({
+        'message': 'Stickers have been queued for printing.',
+        'job_id': job.id,
+        'status_url': url_for('main.render_job_status', job_id=job.id)
+    })
+    response.status_code = 202
+    return response
+
+def replay_response(record):
+    """
+    Answer a repeated request with what the first one produced: its render job or its streamed output.
+    A key is only committed together with one of them, so a key with neither is one whose render job
+    has since been deleted, and gets 410 Gone like an evicted artifact.
+    """
+    if record.render_job is not None:
+        response = render_job_response(record.render_job)
+    elif record.artifact_id is not None:
+        response = streamed_output_response(record.artifact_id, record.output_format, record.printer_copies)
+    else:
+        response = artifact_gone_response()
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def request_hash():
+    """
+    SHA-256 of the endpoint, query string and body of the current request, normalized so the same
+    print request hashes the same however its fields are ordered. The form's CSRF token is left out.
+    """
+    if request.is_json:
+        body = request.get_json(silent=True)
+    else:
+        body = sorted((key, value) for key, value in request.form.items(multi=True) if key != 'csrf_token')
+    normalized = json.dumps([request.endpoint, request.view_args, sorted(request.args.items(multi=True)), body],
+                            sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def idempotent_response(record, hash_value):
+    """replay_response for a key used by the same request before, or 422 if it was used for a different one."""
+    if record.request_hash is not None and record.request_hash != hash_value:
+        response = jsonify({'message': 'This Idempotency-Key was already used for a different print request.'})
+        response.status_code = 422
+        return response
+    return replay_response(record)
+
+def claim_idempotency_key(output_format, printer_copies):
+    """
+    Record the request's Idempotency-Key header, if any, for the current user in this transaction.
+    Returns (record, None), or (None, response) when the key was already used within IDEMPOTENCY_KEY_TTL:
+    the first request's result, or 422 if the key came with a different request.
+    A concurrent duplicate waits on the unique index until the first request commits, then gets its result.
+    """
+    key = request.headers.get('Idempotency-Key', '').strip()[:255]
+    if not key:
+        return None, None
+    expired_before = datetime.utcnow() - timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+    IdempotencyKey.query.filter(IdempotencyKey.user_id == current_user.id,
+                                IdempotencyKey.created_at < expired_before).delete(synchronize_session=False)
+
+    hash_value = request_hash()
+    record = IdempotencyKey.query.filter_by(user_id=current_user.id, key=key).first()
+    if record is not None:
+        return None, idempotent_response(record, hash_value)
+    record = IdempotencyKey(user_id=current_user.id, key=key, output_format=output_format, printer_copies=printer_copies,
+                            request_hash=hash_value)
+    try:
+        with db.session.begin_nested():
+            db.session.add(record)
+    except IntegrityError:
+        record = IdempotencyKey.query.filter_by(user_id=current_user.id, key=key).first()
+        return None, idempotent_response(record, hash_value)
+    return record, None
 
 @main.route('/print', methods=['GET', 'POST'])
 @login_required
@@ -32,7 +197,7 @@ def multi_product_print_view():
                 'exp_date': form.exp_date.data
             })
 
-    return render_template('multi_print.html', form=form, selected_products=selected_products)
+    return render_template('multi_print.html', form=form, selected_products=selected_products, printers=enabled_printers())
 
 @main.route('/print/<int:product_id>', methods=['GET', 'POST'])
 @login_required
@@ -45,6 +210,12 @@ def print_stickers_for_product(product_id):
     form.product_id.choices = [(product.id, product.name)]
 
     if request.method == 'POST' and form.validate_on_submit():
+        output_format, printer_copies, printer, error = requested_output_format()
+        if error:
+            return error
+        idempotency_record, replay = claim_idempotency_key(output_format, printer_copies)
+        if replay:
+            return replay
         quantity = form.quantity.data
 
         mfg_date = form.mfg_date.data or datetime.now().date()
@@ -52,45 +223,50 @@ def print_stickers_for_product(product_id):
 
         batch_number = generate_batch_number(product.name)
 
-        stickers = [
-            Sticker(
-                product_name=product.name,
-                rate=str(product.rate),  # Convert Decimal to string for sticker
-                mfg_date=mfg_date,
-                exp_date=exp_date,
-                net_weight=product.net_weight,
-                ingredients=product.ingredients,
-                nutritional_facts=product.nutritional_facts,
-                batch_number=batch_number,
-                allergen_information=product.allergen_information
-            )
-            for _ in range(quantity)
-        ]
-
-        # Create the PDF file
-        pdf_path = create_stickers_pdf(stickers)
+        # Print from a snapshot of the product, so the job can be reproduced after later edits
+        revision = current_revisions([product])[product.id]
+        sticker = Sticker.from_revision(revision, mfg_date, exp_date, batch_number)
+
+        runs = [StickerRun(sticker, quantity)]
+        render_job = None
+        # Output for a printer always goes through the queue, which hands it to the dispatch workers
+        if wants_streamed_pdf() and printer is None:
+            # Create the output in this request, or reuse it if this exact job was rendered before
+            artifact_id = render_output(runs, output_format, printer_copies=printer_copies)
+            response = streamed_output_response(artifact_id, output_format, printer_copies)
+            if idempotency_record:
+                idempotency_record.artifact_id = artifact_id
+        else:
+            try:
+                render_job = enqueue_render_job(current_user.id, runs, output_format, printer_copies,
+                                                printer.id if printer else None)
+            except QueueFullError as e:
+                db.session.rollback()
+                return queue_full_response(e)
+            if idempotency_record:
+                idempotency_record.render_job = render_job
 
         # Create print job with proper relationships
         print_job = PrintJob(
             product_id=product.id,
             user_id=current_user.id,
             quantity=quantity,
-            batch_number=batch_number
+            batch_number=batch_number,
+            revision_id=revision.id
         )
         db.session.add(print_job)
         db.session.commit()
 
-        return jsonify({
-            'message': 'Stickers has been generated successfully!',
-            'pdf_url': url_for('main.sticker_preview')
-        })
+        if render_job is not None:
+            response = render_job_response(render_job)
+        return response
 
     if request.method == 'GET':
         form.product_id.data = product.id
         form.mfg_date.data = datetime.now().date()
         form.exp_date.data = datetime.now().date() + timedelta(days=product.shelf_life)
 
-    return render_template('print.html', form=form)
+    return render_template('print.html', form=form, printers=enabled_printers())
 
 @main.route('/print_stickers', methods=['POST'])
 @login_required
@@ -99,63 +275,168 @@ def print_stickers_route():
     Handles AJAX request to print stickers for multiple products.
     """
     selected_products = request.get_json()
-    all_stickers = []  # Create a list to hold stickers from all products
+    sticker_runs = []  # One run of identical stickers per product
+    output_format, printer_copies, printer, error = requested_output_format()
+    if error:
+        return error
 
     if selected_products:
-        for product_data in selected_products:
-            product_id = product_data.get('id')
-            product = Product.query.get(product_id)
-            quantity = int(product_data.get('quantity'))
-            mfg_date = datetime.strptime(product_data.get('mfg_date'), '%Y-%m-%d').date()
-            exp_date = datetime.strptime(product_data.get('exp_date'), '%Y-%m-%d').date()
-
-            batch_number = generate_batch_number(product.name)
-
-            # Generate stickers for the current product
-            stickers = [
-                Sticker(
-                    product_name=product.name,
-                    rate=str(product.rate),  # Convert Decimal to string for sticker
-                    mfg_date=mfg_date,
-                    exp_date=exp_date,
-                    net_weight=product.net_weight,
-                    ingredients=product.ingredients,
-                    nutritional_facts=product.nutritional_facts,
-                    batch_number=batch_number,
-                    allergen_information=product.allergen_information
-                )
-                for _ in range(quantity)
-            ]
-
-            # Append the generated stickers to the all_stickers list
-            all_stickers.extend(stickers)
-
-            # Create print job with proper relationships
-            print_job = PrintJob(
-                product_id=product.id,
-                user_id=current_user.id,
-                quantity=quantity,
-                batch_number=batch_number
-            )
-            db.session.add(print_job)
+        idempotency_record, replay = claim_idempotency_key(output_format, printer_copies)
+        if replay:
+            return replay
+        try:
+            lines = [(int(product_data.get('id')),
+                      int(product_data.get('quantity')),
+                      datetime.strptime(product_data.get('mfg_date'), '%Y-%m-%d').date(),
+                      datetime.strptime(product_data.get('exp_date'), '%Y-%m-%d').date())
+                     for product_data in selected_products]
+        except (TypeError, ValueError):
+            return jsonify({'message': 'Each product needs a quantity, manufacturing date and expiry date.'}), 400
+        if any(quantity <= 0 for _, quantity, _, _ in lines):
+            return jsonify({'message': 'Quantities must be greater than zero.'}), 400
 
+        # Load every product in the order with one query
+        products = {product.id: product
+                    for product in Product.query.filter(Product.id.in_({product_id for product_id, _, _, _ in lines}))}
+        missing = sorted({product_id for product_id, _, _, _ in lines} - products.keys())
+        if missing:
+            return jsonify({'message': f'Products not found: {", ".join(str(product_id) for product_id in missing)}'}), 400
+
+        # One batch number per line of the order, allocated together
+        batch_numbers = allocate_batch_numbers([products[product_id].name for product_id, _, _, _ in lines])
+        # Print from snapshots of the products, so the jobs can be reproduced after later edits
+        revisions = current_revisions(products.values())
+
+        print_jobs = []
+        for (product_id, quantity, mfg_date, exp_date), batch_number in zip(lines, batch_numbers):
+            revision = revisions[product_id]
+
+            # Generate the sticker run for the current product
+            sticker = Sticker.from_revision(revision, mfg_date, exp_date, batch_number)
+            sticker_runs.append(StickerRun(sticker, quantity))
+            print_jobs.append({
+                'product_id': product_id,
+                'user_id': current_user.id,
+                'quantity': quantity,
+                'batch_number': batch_number,
+                'revision_id': revision.id
+            })
+
+        # Create all print jobs in one INSERT
+        db.session.execute(db.insert(PrintJob), print_jobs)
+
+        if wants_streamed_pdf() and printer is None:
+            # Create the output for all stickers in this request; the print jobs are committed once it exists
+            artifact_id = render_output(sticker_runs, output_format, printer_copies=printer_copies)
+            if idempotency_record:
+                idempotency_record.artifact_id = artifact_id
+            db.session.commit()
+            return streamed_output_response(artifact_id, output_format, printer_copies)
+
+        # The print jobs and the render job are committed together, so a refused render records nothing
+        try:
+            render_job = enqueue_render_job(current_user.id, sticker_runs, output_format, printer_copies,
+                                            printer.id if printer else None)
+        except QueueFullError as e:
+            db.session.rollback()
+            return queue_full_response(e)
+        if idempotency_record:
+            idempotency_record.render_job = render_job
         db.session.commit()
-        
-        # Create PDF for all stickers
-        pdf_path = create_stickers_pdf(all_stickers)
 
-        return jsonify({
-            'message': 'Stickers has been generated successfully!',
-            'pdf_url': url_for('main.sticker_preview')
-        })
+        return render_job_response(render_job)
 
     return jsonify({'message': 'No products selected for printing. Please select at least one product.'})
 
-@main.route('/sticker_preview')
+@main.route('/render_jobs/<int:job_id>')
+@login_required
+def render_job_status(job_id):
+    """
+    Report a queued render's status and progress; finished jobs include the PDF URL, and jobs for a
+    printer include how far sending it has got.
+    """
+    job = RenderJob.query.get(job_id)
+    if job is None or (job.user_id != current_user.id and current_user.role != 'store_admin'):
+        abort(404)
+
+    data = {
+        'job_id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total
+    }
+    if job.batch_id is not None:
+        data['batch_id'] = job.batch_id
+    if job.status == 'queued':
+        data['queue_position'] = RenderJob.query.filter(RenderJob.status == 'queued', RenderJob.id < job.id).count() + 1
+    elif job.status == 'done':
+        data['artifact_id'] = job.artifact_id
+        data['output_format'] = job.output_format
+        data['output_url'] = output_url(job.artifact_id, job.output_format)
+        if job.output_format == 'pdf':
+            data['pdf_url'] = data['output_url']
+        ticket_url = job_ticket_url(job.artifact_id, job.output_format, job.printer_copies)
+        if ticket_url:
+            data['ticket_url'] = ticket_url
+    elif job.status == 'failed':
+        data['message'] = 'An error occurred while generating the stickers.'
+    if job.printer is not None:
+        data['printer'] = job.printer.name
+        dispatch = job.dispatches[-1] if job.dispatches else None
+        if dispatch is not None:
+            data['dispatch_status'] = dispatch.status
+            data['bytes_sent'] = dispatch.bytes_sent
+            if dispatch.status == 'failed':
+                data['message'] = f'The stickers could not be sent to {job.printer.name}: {dispatch.error}'
+    return jsonify(data)
+
+@main.route('/render_jobs/metrics')
+@login_required
+@store_admin_required
+def render_batch_metrics():
+    """
+    Render batching over the last ?minutes= (default 60): batch count and size, and how long jobs queued.
+    """
+    minutes = request.args.get('minutes', 60, type=int)
+    return jsonify(batch_metrics(datetime.utcnow() - timedelta(minutes=minutes)))
+
+@main.route('/sticker_preview/<artifact_id>')
+@login_required
+def sticker_preview(artifact_id):
+    """
+    Serve a generated sticker PDF inline. Artifacts are immutable, so clients may cache them.
+    """
+    if not ARTIFACT_ID_PATTERN.match(artifact_id):
+        abort(404)
+    pdf_path = get_artifact(artifact_id)
+    if pdf_path is None:
+        abort(404)
+    return send_file(pdf_path, mimetype='application/pdf', max_age=86400, etag=artifact_id)
+
+@main.route('/sticker_ticket/<artifact_id>')
+@login_required
+def sticker_ticket(artifact_id):
+    """
+    Serve the job ticket of a printer-copies PDF: the copy count for each page.
+    """
+    if not ARTIFACT_ID_PATTERN.match(artifact_id):
+        abort(404)
+    path = get_artifact(artifact_id, 'json')
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='application/json', max_age=86400, etag=artifact_id)
+
+@main.route('/sticker_output/<artifact_id>.<output_format>')
 @login_required
-def sticker_preview():
+def sticker_output(artifact_id, output_format):
     """
-    Serve the generated PDF file inline.
+    Download a generated printer program (ZPL or TSPL) for sending to a label printer.
     """
-    pdf_path = os.path.join(current_app.root_path, '..', 'stickers_to_print.pdf')
-    return send_file(pdf_path, mimetype='application/pdf')
+    if output_format == 'pdf' or output_format not in OUTPUT_MIMETYPES or not ARTIFACT_ID_PATTERN.match(artifact_id):
+        abort(404)
+    path = get_artifact(artifact_id, output_format)
+    if path is None:
+        abort(404)
+    mimetype, _ = OUTPUT_MIMETYPES[output_format]
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=f'stickers.{output_format}',
+                     max_age=86400, etag=artifact_id)
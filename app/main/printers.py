@@ -0,0 +1,77 @@
+from flask import redirect, url_for, flash
+from flask_login import login_required
+
+from app import db
+from app.models import Printer, StickerDesign
+from app.forms import PrinterForm
+from app.print_dispatch import PrinterError, check_printer
+from .decorators import store_admin_required
+
+from . import main
+
+@main.route('/printers', methods=['POST'])
+@login_required
+@store_admin_required
+def add_printer():
+    """
+    Register a network printer for the current sticker design.
+    """
+    form = PrinterForm()
+    if form.validate_on_submit():
+        try:
+            design = StickerDesign.query.first()
+            if form.is_default.data:
+                Printer.query.update({Printer.is_default: False})
+            printer = Printer(
+                name=form.name.data,
+                sticker_design_id=design.id if design else None,
+                protocol=form.protocol.data,
+                host=form.host.data.strip(),
+                port=form.port.data,
+                path=form.path.data if form.protocol.data == 'ipp' else None,
+                output_format=form.output_format.data,
+                is_default=form.is_default.data
+            )
+            db.session.add(printer)
+            db.session.commit()
+            flash(f'Printer {printer.name} added successfully.', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'An error occurred while adding the printer: {str(e)}', 'danger')
+    else:
+        for field, errors in form.errors.items():
+            for error in errors:
+                flash(f'{getattr(form, field).label.text}: {error}', 'danger')
+    return redirect(url_for('main.sticker_design'))
+
+@main.route('/printers/<int:printer_id>/delete', methods=['POST'])
+@login_required
+@store_admin_required
+def delete_printer(printer_id):
+    """
+    Remove a printer along with its spooled dispatches.
+    """
+    printer = Printer.query.get_or_404(printer_id)
+    try:
+        db.session.delete(printer)
+        db.session.commit()
+        flash(f'Printer {printer.name} deleted successfully.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'An error occurred while deleting the printer: {str(e)}', 'danger')
+    return redirect(url_for('main.sticker_design'))
+
+@main.route('/printers/<int:printer_id>/check', methods=['POST'])
+@login_required
+@store_admin_required
+def check_printer_connection(printer_id):
+    """
+    Check that a printer's port can be reached from the server.
+    """
+    printer = Printer.query.get_or_404(printer_id)
+    try:
+        check_printer(printer)
+        flash(f'Printer {printer.name} is reachable.', 'success')
+    except PrinterError as e:
+        flash(str(e), 'danger')
+    return redirect(url_for('main.sticker_design'))
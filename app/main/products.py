@@ -1,15 +1,18 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import render_template, redirect, url_for, flash, request, jsonify, current_app, Response
 from flask_login import login_required
-from flask_paginate import Pagination, get_page_parameter
 from datetime import datetime, timedelta
 from decimal import Decimal
-from sqlalchemy import desc
-import random
+from sqlalchemy.dialects.postgresql import insert
+from collections import Counter
 import string
 
 from app import db
-from app.models import Product, ProductCategory
+from app.models import Product, ProductCategory, BatchCounter, PrintJob
 from app.forms import ProductForm, ProductSearchForm
+from app.revisions import record_product_revision
+from app.autocomplete import autocomplete_products, refresh_autocomplete
+from app.pagination import keyset_paginate
+from app.catalog import catalog_state, catalog_snapshot, catalog_changes, parse_version
 from .utils import get_api_key, generate_ingredients, generate_nutritional_facts, generate_allergen_info
 
 from . import main
@@ -17,21 +20,61 @@ from . import main
 # Constants for pagination
 PER_PAGE = 10
 
+BATCH_SEQUENCE_DIGITS = string.digits + string.ascii_uppercase
+
+def _batch_sequence(value):
+    """Base 36, at least 3 characters wide."""
+    chars = ''
+    while value:
+        value, digit = divmod(value, 36)
+        chars = BATCH_SEQUENCE_DIGITS[digit] + chars
+    return chars.rjust(3, '0')
+
+def _reserve_sequences(counts):
+    """Take counts[key] consecutive values from each key's counter; returns the first value of each."""
+    # Rows are locked in key order, so two orders cannot deadlock
+    stmt = insert(BatchCounter).values([{'prefix': key, 'value': counts[key]} for key in sorted(counts)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[BatchCounter.prefix],
+        set_={'value': BatchCounter.value + stmt.excluded.value}
+    ).returning(BatchCounter.prefix, BatchCounter.value)
+    with db.engine.begin() as connection:
+        last_values = dict(connection.execute(stmt).all())
+    return {key: last_values[key] - count + 1 for key, count in counts.items()}
+
+def allocate_batch_numbers(product_names):
+    """
+    Helper function to generate unique batch numbers, one per product name and in the same order.
+    Format: B<Product Initials><Date><Time><Sequence>
+
+    The sequence counts up per set of initials in the batch_counter table and never restarts, so a
+    number cannot come round again when the day and time repeat next month. A whole order takes its
+    numbers in a single INSERT ... ON CONFLICT DO UPDATE, committed straight away on its own
+    connection, so concurrent orders never get the same number and never wait on each other's print jobs.
+    Numbers that happen to match an older batch number with a random suffix are skipped.
+    """
+    # Get current timestamp with minutes
+    timestamp = datetime.now().strftime('%d%H%M')
+    keys = [f"B{''.join([word[0] for word in name.split()]).upper()}" for name in product_names]
+    batch_numbers = [None] * len(keys)
+    pending = list(range(len(keys)))
+    while pending:
+        next_values = _reserve_sequences(Counter(keys[index] for index in pending))
+        for index in pending:
+            key = keys[index]
+            batch_numbers[index] = f'{key}{timestamp}{_batch_sequence(next_values[key])}'
+            next_values[key] += 1
+        with db.session.no_autoflush:
+            taken = {number for number, in PrintJob.query.with_entities(PrintJob.batch_number)
+                     .filter(PrintJob.batch_number.in_([batch_numbers[index] for index in pending]))}
+        pending = [index for index in pending if batch_numbers[index] in taken]
+    return batch_numbers
+
 def generate_batch_number(product_name):
     """
     Helper function to generate a unique batch number for a product.
-    Format: B<Product Initials><Date><Time><Random>
     """
-    # Get product initials
-    initials = ''.join([word[0] for word in product_name.split()]).upper()
-    
-    # Get current timestamp with seconds
-    timestamp = datetime.now().strftime('%d%H%M')
-    
-    # Add random characters to ensure uniqueness
-    random_chars = ''.join(random.choices(string.ascii_uppercase + string.digits, k=3))
-    
-    return f'B{initials}{timestamp}{random_chars}'
+    return allocate_batch_numbers([product_name])[0]
 
 @main.route('/products', methods=['GET'])
 @login_required
@@ -40,7 +83,6 @@ def list_products():
     View function for listing all products.
     Handles AJAX search and regular page display with table layout.
     """
-    page = request.args.get(get_page_parameter(), type=int, default=1)
     form = ProductSearchForm()
 
     search_term = request.args.get('q') 
@@ -48,37 +90,26 @@ def list_products():
     if search_term is not None:  # Check if search_term is provided
         # AJAX search request
         if search_term:  # Check if search_term is not empty
-            products = Product.query.filter(
-                Product.name.ilike(f'%{search_term}%')
-            ).order_by(Product.name).all()
+            products = autocomplete_products(search_term)
             return jsonify([{
-                'id': p.id,
-                'name': p.name,
-                'category': p.category.name if p.category else 'N/A',
-                'net_weight': p.net_weight,
-                'rate': str(p.rate)
+                'id': p['id'],
+                'name': p['name'],
+                'category': p['category'],
+                'net_weight': p['net_weight'],
+                'rate': p['rate']
             } for p in products])
         return jsonify([])
     
-    # Regular product listing with pagination
-    products_pagination = Product.query.order_by(
-        desc(Product.updated_at)
-    ).paginate(
-        page=page,
-        per_page=PER_PAGE,
-        error_out=False
+    # Regular product listing, last updated first, continuing from the ?after=/?before= cursor
+    products_pagination = keyset_paginate(
+        Product.query.options(db.joinedload(Product.category)),
+        Product.updated_at, Product.id, PER_PAGE, 'product', 'product'
     )
     
     return render_template(
         'products.html',
         products=products_pagination.items,
-        pagination=Pagination(
-            page=page,
-            total=products_pagination.total,
-            search=False,
-            per_page=PER_PAGE,
-            css_framework='bootstrap4'
-        ),
+        pagination=products_pagination,
         form=form
     )
 
@@ -97,19 +128,33 @@ def search_products_post():
     
     search_term = request.args.get('q')
     if search_term:
-        products = Product.query.filter(
-            Product.name.ilike(f'%{search_term}%')
-        ).order_by(Product.name).all()
-        return jsonify([{
-            'id': p.id,
-            'name': p.name,
-            'shelf_life': p.shelf_life,
-            'category': p.category.name if p.category else 'N/A',
-            'net_weight': p.net_weight,
-            'rate': str(p.rate)
-        } for p in products])
+        return jsonify(autocomplete_products(search_term))
     return jsonify([])
 
+@main.route('/catalog')
+@login_required
+def catalog():
+    """
+    Printable products for the print screen to filter locally: all of them, or with ?since=<version>
+    only those changed and deleted since. Answers 304 when the client's ETag is still current.
+    """
+    since = request.args.get('since')
+    try:
+        since = parse_version(since) if since else None
+    except ValueError:
+        return jsonify({'error': 'since must be a version returned by an earlier catalog request'}), 400
+
+    state = catalog_state()
+    if state.etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(catalog_changes(state, since) if since else catalog_snapshot(state))
+    response.set_etag(state.etag)
+    # The browser keeps the copy but must check it is current each time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @main.route('/product/new', methods=['GET', 'POST'])
 @login_required
 def new_product():
@@ -141,6 +186,8 @@ def new_product():
             )
             db.session.add(product)
             db.session.commit()
+            record_product_revision(product)
+            refresh_autocomplete()
             flash('Product has been created!', 'success')
             return redirect(url_for('main.list_products'))
         except Exception as e:
@@ -178,6 +225,8 @@ def edit_product(product_id):
             product.allergen_information = form.allergen_information.data
             
             db.session.commit()
+            record_product_revision(product)
+            refresh_autocomplete()
             flash('Product has been updated!', 'success')
             return redirect(url_for('main.list_products'))
         except Exception as e:
@@ -210,6 +259,7 @@ def delete_product(product_id):
     try:
         db.session.delete(product)
         db.session.commit()
+        refresh_autocomplete()
         flash('Product has been deleted!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -236,6 +286,8 @@ def duplicate_product(product_id):
         )
         db.session.add(duplicate)
         db.session.commit()
+        record_product_revision(duplicate)
+        refresh_autocomplete()
         return redirect(url_for('main.edit_product', product_id=duplicate.id, is_duplicate='true'))
     except Exception as e:
         db.session.rollback()
@@ -254,6 +306,7 @@ def cancel_edit(product_id, is_duplicate):
         try:
             db.session.delete(product)
             db.session.commit()
+            refresh_autocomplete()
             flash('Duplicate product discarded.', 'info')
         except Exception as e:
             db.session.rollback()
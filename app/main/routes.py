@@ -11,8 +11,9 @@ from functools import wraps
 import os
 
 from app import db
-from app.models import User, Product, ProductCategory, PrintJob, StoreInfo, StickerDesign
-from app.forms import LoginForm, RegisterForm, StoreInfoForm
+from app.models import User, Product, ProductCategory, PrintJob, StoreInfo, StickerDesign, Printer
+from app.forms import LoginForm, RegisterForm, StoreInfoForm, PrinterForm
+from app.sticker import compile_layout, invalidate_design_caches, warm_sticker_caches
 
 from . import main
 
@@ -128,6 +129,7 @@ def sticker_design():
                     design.bg_image = None
                     design.use_bg_image = False
                 db.session.commit()
+                invalidate_design_caches()
                 flash('Background image cleared successfully.', 'success')
                 return redirect(url_for('main.sticker_design'))
 
@@ -159,6 +161,9 @@ def sticker_design():
                     "max_width": float(request.form[f'{element}_position_max_width']),
                     "font_size": float(request.form.get(f'{element}_position_font_size', design.content_font_size))
                 }
+                # The editor has no control for the Paragraph markup opt-in; keep it as it was
+                if (getattr(design, f'{element}_position') or {}).get('rich'):
+                    position['rich'] = True
                 setattr(design, f'{element}_position', position)
                 setattr(design, f'print_{element}', request.form.get(f'print_{element}', 'off') == 'on')
 
@@ -171,6 +176,9 @@ def sticker_design():
                     "max_width": float(request.form[f'{element}_position_max_width']),
                     "font_size": float(request.form.get(f'{element}_position_font_size', design.content_font_size))
                 }
+                # The editor has no control for the Paragraph markup opt-in; keep it as it was
+                if (getattr(design, f'{element}_position') or {}).get('rich'):
+                    position['rich'] = True
                 setattr(design, f'{element}_position', position)
 
             design.heading_font_size = float(request.form['heading_font_size'])
@@ -203,7 +211,12 @@ def sticker_design():
                     bg_image.save(os.path.join(uploads_dir, filename))
                     design.bg_image = os.path.join('uploads', 'backgrounds', filename)
 
+            # Reject designs the renderer cannot draw before they are saved
+            compile_layout(design)
+
             db.session.commit()
+            invalidate_design_caches()
+            warm_sticker_caches()
             flash('Sticker design updated successfully.', 'success')
         except ValueError as e:
             db.session.rollback()
@@ -213,4 +226,5 @@ def sticker_design():
             flash(f'An error occurred: {str(e)}', 'danger')
         return redirect(url_for('main.sticker_design'))
 
-    return render_template('sticker_design.html', design=design)
+    printers = Printer.query.order_by(Printer.name).all()
+    return render_template('sticker_design.html', design=design, printers=printers, printer_form=PrinterForm())
@@ -13,6 +13,9 @@ from werkzeug.utils import secure_filename
 from app import db
 from app.models import Setting, StoreInfo, Product, ProductCategory, StickerDesign
 from app.forms import StoreInfoForm
+from app.sticker import invalidate_design_caches, warm_sticker_caches
+from app.revisions import record_product_revision
+from app.autocomplete import refresh_autocomplete
 from .backups import read_auto_backup_time, create_backup, set_auto_backup_time
 from .utils import encrypt_key, decrypt_key, generate_ingredients, generate_nutritional_facts, generate_allergen_info
 from .decorators import store_admin_required
@@ -116,6 +119,8 @@ def settings():
 
                 store_info_form.populate_obj(store_info)
                 db.session.commit()
+                invalidate_design_caches()
+                warm_sticker_caches()
                 flash('Store information updated successfully.', 'success')
             else:
                 flash('Error updating store information. Please check the form.', 'danger')
@@ -153,8 +158,10 @@ def import_export():
                     data = file.read().decode('utf-8')
                     if import_type == 'product_categories':
                         import_product_and_categories(io.StringIO(data), auto_generate)
+                        refresh_autocomplete()
                     elif import_type == 'sticker_design':
                         import_data(StickerDesign, io.StringIO(data), sticker_design_mapper)
+                        invalidate_design_caches()
                     else:
                         flash('Invalid import type selected.', 'danger')
                     flash(f'{import_type.replace("_", " ").capitalize()} data imported successfully.', 'success')
@@ -166,7 +173,7 @@ def import_export():
     return render_template('import_export.html')
 
 def export_product_and_categories():
-    products = Product.query.all()
+    products = Product.query.options(db.joinedload(Product.category)).all()
     csv_output = io.StringIO()
     writer = csv.writer(csv_output)
     
@@ -235,6 +242,8 @@ def import_product_and_categories(data_stream, auto_generate):
                     product.allergen_information = generate_allergen_info(product.ingredients, api_key)
                     db.session.commit()
 
+            record_product_revision(product)
+
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"Error importing product {row.get('name')}: {str(e)}")
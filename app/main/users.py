@@ -1,12 +1,11 @@
 from flask import render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
-from flask_paginate import Pagination, get_page_parameter
 from werkzeug.security import generate_password_hash
-from sqlalchemy import desc
 from sqlalchemy.exc import IntegrityError
 
 from app import db
 from app.models import User
+from app.pagination import keyset_paginate
 from app.forms import ProfileForm, UserForm
 from .decorators import store_admin_required
 
@@ -69,25 +68,12 @@ def user_management():
     Displays a list of all users with their print job counts.
     """
     try:
-        page = request.args.get(get_page_parameter(), type=int, default=1)
-        users_pagination = User.query.order_by(
-            desc(User.updated_at)
-        ).paginate(
-            page=page,
-            per_page=PER_PAGE,
-            error_out=False
-        )
+        users_pagination = keyset_paginate(User.query, User.updated_at, User.id, PER_PAGE, 'user')
         
         return render_template(
             'user_management.html',
             users=users_pagination.items,
-            pagination=Pagination(
-                page=page,
-                total=users_pagination.total,
-                search=False,
-                per_page=PER_PAGE,
-                css_framework='bootstrap4'
-            )
+            pagination=users_pagination
         )
     except Exception as e:
         current_app.logger.error(f'Error in user management: {str(e)}')
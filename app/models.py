@@ -1,5 +1,7 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from flask_login import UserMixin
 from app import db
 
@@ -20,6 +22,8 @@ class User(UserMixin, TimestampMixin, db.Model):
         db.CheckConstraint('length(username) >= 3', name='check_username_length'),
         db.CheckConstraint('length(password) >= 8', name='check_password_length'),
         db.CheckConstraint("role IN ('staff', 'store_admin')", name='check_valid_role'),
+        # Keyset pagination of the user list (app/pagination.py)
+        db.Index('ix_user_updated_at_id', 'updated_at', 'id'),
     )
 
 class ProductCategory(TimestampMixin, db.Model):
@@ -27,6 +31,14 @@ class ProductCategory(TimestampMixin, db.Model):
     name = db.Column(db.String(100), unique=True, nullable=False, index=True)
     products = db.relationship('Product', backref='category', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # Trigram index for app/search.py; needs the pg_trgm extension
+        db.Index('ix_product_category_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        # Keyset pagination of the category list and autocomplete deltas
+        db.Index('ix_product_category_updated_at_id', 'updated_at', 'id'),
+    )
+
 class Product(TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, index=True)
@@ -38,24 +50,82 @@ class Product(TimestampMixin, db.Model):
     nutritional_facts = db.Column(db.Text, nullable=False)
     allergen_information = db.Column(db.Text, nullable=False)
     print_jobs = db.relationship('PrintJob', backref='product', lazy=True)
+    revisions = db.relationship('ProductRevision', backref='product', lazy=True, passive_deletes=True)
 
     __table_args__ = (
         db.CheckConstraint('rate >= 0', name='check_rate_positive'),
         db.CheckConstraint('shelf_life > 0', name='check_shelf_life_positive'),
+        # Trigram index for app/search.py; needs the pg_trgm extension
+        db.Index('ix_product_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        # Keyset pagination of the product list, and delta queries of the autocomplete index and catalog
+        db.Index('ix_product_updated_at_id', 'updated_at', 'id'),
     )
 
+# Case-insensitive prefix matches (the search fast path) as a btree range scan
+db.Index('ix_product_name_lower_prefix', db.func.lower(Product.name).label('name_lower'),
+         postgresql_ops={'name_lower': 'text_pattern_ops'})
+db.Index('ix_product_category_name_lower_prefix', db.func.lower(ProductCategory.name).label('name_lower'),
+         postgresql_ops={'name_lower': 'text_pattern_ops'})
+
 class PrintJob(TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='SET NULL'), nullable=True)
     quantity = db.Column(db.Integer, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
-    print_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    print_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     batch_number = db.Column(db.String(50), nullable=False, unique=True, index=True)
+    revision_id = db.Column(db.Integer, db.ForeignKey('product_revision.id', ondelete='SET NULL'), nullable=True, index=True)
+    revision = db.relationship('ProductRevision')
 
     __table_args__ = (
         db.CheckConstraint('quantity > 0', name='check_quantity_positive'),
+        # Keyset pagination newest first (Postgres scans these backwards), for everyone and for one staff member
+        db.Index('ix_print_job_print_date_id', 'print_date', 'id'),
+        db.Index('ix_print_job_user_print_date_id', 'user_id', 'print_date', 'id'),
+    )
+
+class ProductRevision(TimestampMixin, db.Model):
+    """
+    Immutable snapshot of a product's printed content, identified by a hash of that content (app/revisions.py).
+    Kept when the product is deleted so its print jobs can still be reproduced.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='SET NULL'), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    rate = db.Column(db.Numeric(10, 2), nullable=False)
+    net_weight = db.Column(db.String(20), nullable=False)
+    ingredients = db.Column(db.Text, nullable=False)
+    nutritional_facts = db.Column(db.Text, nullable=False)
+    allergen_information = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'content_hash', name='uq_product_revision_content'),
     )
 
+class BatchCounter(db.Model):
+    """
+    Last sequence number handed out for each set of product initials ("B" + initials). Sequences never
+    restart, so numbers stay unique although the timestamp in them has no month or year.
+    """
+    prefix = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False)
+
+class ProductTombstone(db.Model):
+    """A deleted product, so clients holding a copy of the catalog (app/catalog.py) can drop it."""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+@event.listens_for(Product, 'after_delete')
+def record_product_tombstone(mapper, connection, target):
+    """Record every product deleted through the ORM, including by the category cascade, and prune old tombstones."""
+    now = datetime.utcnow()
+    tombstones = ProductTombstone.__table__
+    connection.execute(tombstones.insert().values(product_id=target.id, deleted_at=now))
+    expired_before = now - timedelta(seconds=current_app.config['CATALOG_TOMBSTONE_TTL'])
+    connection.execute(tombstones.delete().where(tombstones.c.deleted_at < expired_before))
+
 class StoreInfo(TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=True)
@@ -116,6 +186,7 @@ class StickerDesign(TimestampMixin, db.Model):
     custom_paper_width = db.Column(db.Float, nullable=True)
     custom_paper_height = db.Column(db.Float, nullable=True)
     paper_orientation = db.Column(db.String(20), nullable=False, default='portrait')
+    printers = db.relationship('Printer', backref='sticker_design', lazy=True, order_by='Printer.name')
 
     __table_args__ = (
         db.CheckConstraint('heading_font_size > 0', name='check_heading_font_size_positive'),
@@ -138,3 +209,85 @@ class Setting(TimestampMixin, db.Model):
             name='check_time_format'
         ),
     )
+
+class RenderJob(TimestampMixin, db.Model):
+    """A queued sticker PDF render, consumed by the workers in app/print_queue.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    payload = db.Column(db.JSON, nullable=False)  # [{"sticker": {...}, "count": n}, ...]
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    output_format = db.Column(db.String(10), nullable=False, default='pdf')
+    printer_copies = db.Column(db.Boolean, nullable=False, default=False)
+    printer_id = db.Column(db.Integer, db.ForeignKey('printer.id', ondelete='SET NULL'), nullable=True)
+    batch_id = db.Column(db.Integer, nullable=True, index=True)  # Id of the first job of the batch it was rendered in
+    artifact_id = db.Column(db.String(64), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    user = db.relationship('User', backref=db.backref('render_jobs', lazy=True))
+    printer = db.relationship('Printer')
+    dispatches = db.relationship('PrintDispatch', backref='render_job', lazy=True, order_by='PrintDispatch.id')
+
+    __table_args__ = (
+        db.CheckConstraint("status IN ('queued', 'running', 'done', 'failed')", name='check_valid_render_status'),
+        db.CheckConstraint("output_format IN ('pdf', 'zpl', 'tspl')", name='check_valid_output_format'),
+        db.Index('ix_render_job_status_id', 'status', 'id'),
+    )
+
+class IdempotencyKey(TimestampMixin, db.Model):
+    """A client-supplied Idempotency-Key of a print request, and what that request produced."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    render_job_id = db.Column(db.Integer, db.ForeignKey('render_job.id', ondelete='SET NULL'), nullable=True)
+    artifact_id = db.Column(db.String(64), nullable=True)  # Set once a streamed render has finished
+    output_format = db.Column(db.String(10), nullable=False, default='pdf')
+    printer_copies = db.Column(db.Boolean, nullable=False, default=False)
+    # SHA-256 of the endpoint and normalized request, so a key reused for a different request is refused
+    request_hash = db.Column(db.String(64), nullable=True)
+    render_job = db.relationship('RenderJob')
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_key'),
+    )
+
+class Printer(TimestampMixin, db.Model):
+    """A network printer that generated output can be sent to directly (raw TCP or IPP)."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    sticker_design_id = db.Column(db.Integer, db.ForeignKey('sticker_design.id', ondelete='CASCADE'), nullable=True)
+    protocol = db.Column(db.String(10), nullable=False, default='raw')
+    host = db.Column(db.String(255), nullable=False)
+    port = db.Column(db.Integer, nullable=False, default=9100)
+    path = db.Column(db.String(255), nullable=True)  # IPP resource, e.g. /ipp/print
+    output_format = db.Column(db.String(10), nullable=False, default='pdf')
+    is_default = db.Column(db.Boolean, nullable=False, default=False)
+    enabled = db.Column(db.Boolean, nullable=False, default=True)
+    dispatches = db.relationship('PrintDispatch', backref='printer', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.CheckConstraint("protocol IN ('raw', 'ipp')", name='check_valid_printer_protocol'),
+        db.CheckConstraint("output_format IN ('pdf', 'zpl', 'tspl')", name='check_valid_printer_output_format'),
+        db.CheckConstraint('port > 0 AND port < 65536', name='check_printer_port_range'),
+    )
+
+class PrintDispatch(TimestampMixin, db.Model):
+    """A rendered artifact spooled for sending to a printer, consumed by app/print_dispatch.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    printer_id = db.Column(db.Integer, db.ForeignKey('printer.id', ondelete='CASCADE'), nullable=False)
+    render_job_id = db.Column(db.Integer, db.ForeignKey('render_job.id', ondelete='SET NULL'), nullable=True, index=True)
+    artifact_id = db.Column(db.String(64), nullable=False)
+    output_format = db.Column(db.String(10), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    bytes_sent = db.Column(db.BigInteger, nullable=False, default=0)  # Known to have left the server; used to resume
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    error = db.Column(db.Text, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.CheckConstraint("status IN ('queued', 'sending', 'sent', 'failed')", name='check_valid_dispatch_status'),
+        db.Index('ix_print_dispatch_status_next_attempt', 'status', 'next_attempt_at'),
+    )
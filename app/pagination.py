@@ -0,0 +1,129 @@
+"""
+Keyset ("seek") pagination for the listing pages. Pages are ordered newest first on a timestamp and
+the id, and a page is reached by a cursor holding the first or last row of its neighbour, so every
+page is one index range scan of per_page rows however deep it is. Totals come from a short-lived
+per-process cache and, for whole large tables on Postgres, from the planner's row estimate.
+"""
+import base64
+import time
+from datetime import datetime
+from flask import current_app, request, url_for
+from markupsafe import Markup, escape
+from sqlalchemy import text
+from app import db
+
+# Whole tables with more rows than this are counted from pg_class.reltuples instead of COUNT(*)
+ESTIMATE_COUNT_ABOVE = 100000
+
+# Totals by cache key: (count, approximate, expires at)
+_counts = {}
+
+def encode_cursor(timestamp, item_id):
+    return base64.urlsafe_b64encode(f'{timestamp.isoformat()}|{item_id}'.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor; raises ValueError if it is not one."""
+    try:
+        timestamp, item_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(timestamp), int(item_id)
+    except (UnicodeError, TypeError, ValueError) as e:
+        raise ValueError(f'Invalid page cursor: {str(e)}')
+
+def listing_count(query, cache_key, table=None):
+    """
+    Return (count, approximate) for query, cached for LISTING_COUNT_CACHE_TTL seconds. When the query
+    covers a whole table, pass its name to use the Postgres estimate once the table is large.
+    """
+    now = time.monotonic()
+    cached = _counts.get(cache_key)
+    if cached is not None and cached[2] > now:
+        return cached[0], cached[1]
+
+    count, approximate = None, False
+    if table is not None and db.engine.dialect.name == 'postgresql':
+        estimate = db.session.execute(text('SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)'),
+                                      {'table': table}).scalar()
+        # reltuples is -1 until the table has been analysed
+        if estimate is not None and estimate > ESTIMATE_COUNT_ABOVE:
+            count, approximate = estimate, True
+    if count is None:
+        count = query.order_by(None).count()
+    _counts[cache_key] = (count, approximate, now + current_app.config['LISTING_COUNT_CACHE_TTL'])
+    return count, approximate
+
+class KeysetPagination:
+    """
+    One page of a listing with links to its neighbours. Renders like the flask-paginate object it
+    replaced: {{ pagination.links }} in the template.
+    """
+    def __init__(self, items, next_cursor, prev_cursor, total, approximate):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.approximate = approximate
+
+    def _url(self, **cursor):
+        args = {key: value for key, value in request.args.items() if key not in ('after', 'before')}
+        args.update(cursor)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    def _link(self, label, href):
+        if href is None:
+            return f'<li class="page-item disabled"><span class="page-link">{label}</span></li>'
+        return f'<li class="page-item"><a class="page-link" href="{escape(href)}">{label}</a></li>'
+
+    @property
+    def links(self):
+        if self.next_cursor is None and self.prev_cursor is None:
+            return Markup('')
+        total = f'{"about " if self.approximate else ""}{self.total:,} total'
+        return Markup(
+            '<nav aria-label="Page navigation"><ul class="pagination">'
+            + self._link('&laquo; Previous', self._url(before=self.prev_cursor) if self.prev_cursor else None)
+            + f'<li class="page-item disabled"><span class="page-link">{total}</span></li>'
+            + self._link('Next &raquo;', self._url(after=self.next_cursor) if self.next_cursor else None)
+            + '</ul></nav>'
+        )
+
+def keyset_paginate(query, timestamp_column, id_column, per_page, count_key, table=None):
+    """
+    Return the KeysetPagination for the page of query selected by the request's ?after= or ?before=
+    cursor, newest first on (timestamp_column, id_column). An invalid cursor shows the first page.
+    """
+    after, before = request.args.get('after'), request.args.get('before')
+    try:
+        cursor = decode_cursor(before or after) if (before or after) else None
+    except ValueError:
+        cursor, before = None, None
+    key = db.tuple_(timestamp_column, id_column)
+
+    page = query
+    if cursor is not None and before:
+        # Rows just newer than the cursor, fetched oldest first and flipped
+        page = page.filter(key > db.tuple_(*cursor)).order_by(timestamp_column, id_column)
+    else:
+        if cursor is not None:
+            page = page.filter(key < db.tuple_(*cursor))
+        page = page.order_by(timestamp_column.desc(), id_column.desc())
+    rows = page.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if cursor is not None and before:
+        rows.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = cursor is not None, more
+
+    def cursor_for(row):
+        return encode_cursor(getattr(row, timestamp_column.key), getattr(row, id_column.key))
+
+    total, approximate = listing_count(query, count_key, table)
+    return KeysetPagination(
+        rows,
+        next_cursor=cursor_for(rows[-1]) if rows and has_older else None,
+        prev_cursor=cursor_for(rows[0]) if rows and has_newer else None,
+        total=total,
+        approximate=approximate
+    )
@@ -0,0 +1,118 @@
+"""
+Multi-process rendering for very large sticker jobs.
+The runs are cut into page-aligned shards, each shard is rendered to its own PDF in a process pool
+and the shard PDFs are stitched back together in order with pypdf. Each shard starts on a fresh page
+and fills whole pages, so page order and the sheet grid come out exactly as a single-process render.
+pypdf is optional: without it every job is rendered in one process.
+"""
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+from app.fonts import register_fonts
+from app.sticker import StickerRun, create_sticker_pdf, stickers_per_page
+
+try:
+    from pypdf import PdfWriter
+except ImportError:  # pragma: no cover - optional dependency
+    PdfWriter = None
+
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+def parallel_render_available():
+    return PdfWriter is not None
+
+def _init_render_process(root_path):
+    # Pool processes are spawned, not forked, so they start without the parent's fonts (or its threads and locks)
+    register_fonts(root_path)
+
+def get_render_pool(processes, root_path):
+    """Return the process pool shared by all render jobs in this process, sized for `processes` workers."""
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size != processes:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_render_process, initargs=(root_path,))
+            _pool_size = processes
+        return _pool
+
+def discard_render_pool():
+    """Drop a pool whose processes died so the next job starts a fresh one."""
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool, _pool_size = None, 0
+
+def split_runs(runs, shard_size):
+    """Split a list of StickerRun into consecutive shards of shard_size stickers (the last may be shorter)."""
+    shards, current, room = [], [], shard_size
+    for sticker, count in runs:
+        while count:
+            take = min(count, room)
+            current.append(StickerRun(sticker, take))
+            count -= take
+            room -= take
+            if not room:
+                shards.append(current)
+                current, room = [], shard_size
+    if current:
+        shards.append(current)
+    return shards
+
+def shard_size_for(plan, total, processes, min_pages):
+    """Stickers per shard: whole pages only, about two shards per process, but never under min_pages pages."""
+    per_page = stickers_per_page(plan)
+    pages = -(-total // per_page)
+    pages_per_shard = max(min_pages, -(-pages // (processes * 2)))
+    return pages_per_shard * per_page
+
+def stitch_shards(paths, pdf_output):
+    """Concatenate the shard PDFs at paths, in order, into pdf_output."""
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(path)
+    writer.write(pdf_output)
+    writer.close()
+
+def _render_shard(runs, layout, path):
+    create_sticker_pdf(runs, path, layout)
+    return path
+
+def create_sticker_pdf_parallel(runs, pdf_output, layout, processes, root_path, min_shard_pages=1, progress=None):
+    """
+    Render like create_sticker_pdf, sharded over `processes` processes, into pdf_output (a path or binary file).
+    progress, if given, is called with the number of stickers rendered as each shard completes.
+    """
+    plan, _ = layout
+    total = sum(count for _, count in runs)
+    shards = split_runs(runs, shard_size_for(plan, total, processes, min_shard_pages))
+    pool = get_render_pool(processes, root_path)
+    shard_dir = tempfile.mkdtemp(prefix='sticker-shards-')
+    try:
+        futures = {
+            pool.submit(_render_shard, shard, layout, os.path.join(shard_dir, f'{index:05d}.pdf')): shard
+            for index, shard in enumerate(shards)
+        }
+        done = 0
+        try:
+            for future in as_completed(futures):
+                future.result()
+                done += sum(count for _, count in futures[future])
+                if progress:
+                    progress(done)
+        except BrokenProcessPool:
+            discard_render_pool()
+            raise
+
+        stitch_shards([os.path.join(shard_dir, f'{index:05d}.pdf') for index in range(len(shards))], pdf_output)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
@@ -0,0 +1,337 @@
+"""
+Direct dispatch of rendered output to network printers.
+Finished render jobs for a printer are spooled as PrintDispatch rows and sent by dispatch worker
+threads, over raw TCP (port 9100, "JetDirect") or IPP. Each printer has one connection per process,
+which also keeps jobs for the same printer from interleaving; IPP sessions are kept alive, while a raw
+job ends by half-closing the socket and waiting for the printer to close it once it has read everything.
+A failed send is retried with backoff; raw ZPL/TSPL jobs resume from the first label the printer had not
+fully received.
+"""
+import select
+import socket
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import requests
+from flask import current_app
+from app import db
+from app.models import PrintDispatch
+from app.artifacts import get_artifact
+from app.label_printer import label_offsets
+
+try:
+    import fcntl
+    import termios
+    # On Linux, TIOCOUTQ on a TCP socket (SIOCOUTQ) is the number of bytes the peer has not acknowledged
+    SIOCOUTQ = termios.TIOCOUTQ
+except (ImportError, AttributeError):  # pragma: no cover - not available on Windows
+    fcntl = None
+
+SEND_CHUNK_SIZE = 64 * 1024
+
+# Acknowledged bytes can still be sitting in the printer's receive buffer, and are lost if it resets,
+# so progress is held back by this much, well above label printers' TCP windows. A resumed job may
+# repeat a few labels rather than skip any
+PRINTER_BUFFER_MARGIN = 256 * 1024
+
+# document-format for IPP Print-Job
+IPP_DOCUMENT_FORMATS = {
+    'pdf': 'application/pdf',
+    'zpl': 'application/octet-stream',
+    'tspl': 'application/octet-stream',
+}
+
+_workers = []
+_workers_lock = threading.Lock()
+
+class PrinterError(Exception):
+    """Raised when a printer cannot be reached or rejects a job."""
+
+class RawConnection:
+    """A TCP connection to a printer's raw port."""
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.last_used = time.monotonic()
+
+    def is_alive(self):
+        if self.sock.fileno() == -1:
+            return False
+        # A printer that hung up makes the socket readable with nothing to read
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            return not readable or self.sock.recv(1, socket.MSG_PEEK) != b''
+        except OSError:
+            return False
+
+    def unacknowledged(self):
+        """Bytes handed to the socket that the printer has not acknowledged yet, or None if the platform cannot tell."""
+        if fcntl is None:
+            return None
+        try:
+            return struct.unpack('i', fcntl.ioctl(self.sock.fileno(), SIOCOUTQ, struct.pack('i', 0)))[0]
+        except OSError:
+            return None
+
+    def send(self, data, on_progress=None):
+        """
+        Send data, calling on_progress after each chunk with the number of bytes the printer has
+        acknowledged so far, less PRINTER_BUFFER_MARGIN. The send queue is read while the connection
+        is healthy, because the kernel discards it when the connection drops. Where it cannot be read,
+        progress stays at 0 so a retry starts from the beginning.
+        """
+        view = memoryview(data)
+        for start in range(0, len(view), SEND_CHUNK_SIZE):
+            self.sock.sendall(view[start:start + SEND_CHUNK_SIZE])
+            if on_progress:
+                unacknowledged = self.unacknowledged()
+                if unacknowledged is not None:
+                    acknowledged = min(start + SEND_CHUNK_SIZE, len(view)) - unacknowledged
+                    on_progress(max(0, acknowledged - PRINTER_BUFFER_MARGIN))
+        self.last_used = time.monotonic()
+
+    def finish(self, timeout):
+        """
+        Half-close the connection and wait up to timeout seconds for the printer to close its side, which
+        it only does once it has read the whole job; a printer that hung up part way resets the connection
+        instead. Raises PrinterError if either happens or the wait times out. The connection is closed after.
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout()
+                self.sock.settimeout(remaining)
+                # Anything the printer sends back (status on some models) is discarded
+                if self.sock.recv(4096) == b'':
+                    return
+        except socket.timeout:
+            raise PrinterError(f'The printer did not take the whole job within {timeout:g} seconds')
+        except OSError as e:
+            raise PrinterError(f'The printer closed the connection before taking the whole job: {str(e)}')
+        finally:
+            self.close()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class IppConnection:
+    """An HTTP keep-alive session to a printer's IPP endpoint."""
+    def __init__(self, host, port, path, timeout):
+        path = path or '/ipp/print'
+        self.printer_uri = f'ipp://{host}:{port}{path}'
+        self.url = f'http://{host}:{port}{path}'
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.request_id = 0
+        self.last_used = time.monotonic()
+
+    def is_alive(self):
+        return True  # requests reconnects by itself
+
+    def print_job(self, data, output_format, job_name):
+        self.request_id += 1
+        body = ipp_print_job_request(self.printer_uri, IPP_DOCUMENT_FORMATS[output_format], job_name, self.request_id)
+        response = self.session.post(self.url, data=body + data, headers={'Content-Type': 'application/ipp'},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        status = int.from_bytes(response.content[2:4], 'big') if len(response.content) >= 4 else 0xFFFF
+        if status >= 0x0100:
+            raise PrinterError(f'IPP Print-Job was rejected with status 0x{status:04x}')
+        self.last_used = time.monotonic()
+
+    def close(self):
+        self.session.close()
+
+def _ipp_attribute(tag, name, value):
+    name, value = name.encode('ascii'), value.encode('utf-8')
+    return bytes([tag]) + len(name).to_bytes(2, 'big') + name + len(value).to_bytes(2, 'big') + value
+
+def ipp_print_job_request(printer_uri, document_format, job_name, request_id=1):
+    """Encode the operation part of an IPP/1.1 Print-Job request; the document data follows it."""
+    return (
+        b'\x01\x01'                    # IPP version 1.1
+        + b'\x00\x02'                  # Print-Job
+        + request_id.to_bytes(4, 'big')
+        + b'\x01'                      # operation-attributes-tag
+        + _ipp_attribute(0x47, 'attributes-charset', 'utf-8')
+        + _ipp_attribute(0x48, 'attributes-natural-language', 'en')
+        + _ipp_attribute(0x45, 'printer-uri', printer_uri)
+        + _ipp_attribute(0x42, 'requesting-user-name', 'product-sticker-app')
+        + _ipp_attribute(0x42, 'job-name', job_name)
+        + _ipp_attribute(0x49, 'document-format', document_format)
+        + b'\x03'                      # end-of-attributes-tag
+    )
+
+class PrinterConnectionPool:
+    """One persistent connection per printer, checked out by a single sender at a time."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._printer_locks = {}
+        self._connections = {}
+
+    def _printer_lock(self, key):
+        with self._lock:
+            return self._printer_locks.setdefault(key, threading.Lock())
+
+    @contextmanager
+    def connection(self, printer, timeout, idle_timeout):
+        key = (printer.protocol, printer.host, printer.port, printer.path)
+        with self._printer_lock(key):
+            conn = self._connections.pop(key, None)
+            if conn is not None and (time.monotonic() - conn.last_used > idle_timeout or not conn.is_alive()):
+                conn.close()
+                conn = None
+            if conn is None:
+                try:
+                    if printer.protocol == 'ipp':
+                        conn = IppConnection(printer.host, printer.port, printer.path, timeout)
+                    else:
+                        conn = RawConnection(printer.host, printer.port, timeout)
+                except OSError as e:
+                    raise PrinterError(f'Could not connect to {printer.host}:{printer.port}: {str(e)}')
+            try:
+                yield conn
+            except Exception:
+                # Never reuse a connection that failed mid-job
+                conn.close()
+                raise
+            if conn.is_alive():
+                self._connections[key] = conn
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+connection_pool = PrinterConnectionPool()
+
+def enqueue_dispatch(printer, artifact_id, output_format, render_job_id=None):
+    """Spool an artifact for sending to printer; returns the PrintDispatch (added to the session, not committed)."""
+    dispatch = PrintDispatch(
+        printer_id=printer.id,
+        render_job_id=render_job_id,
+        artifact_id=artifact_id,
+        output_format=output_format
+    )
+    db.session.add(dispatch)
+    return dispatch
+
+def claim_next_dispatch():
+    """
+    Mark the oldest dispatch that is due as sending and return it, or None if there is nothing to send.
+    Dispatches left sending by a worker that died are picked up again after RENDER_JOB_TIMEOUT seconds.
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=current_app.config['RENDER_JOB_TIMEOUT'])
+    dispatch = (PrintDispatch.query
+                .filter(((PrintDispatch.status == 'queued') & (PrintDispatch.next_attempt_at <= now)) |
+                        ((PrintDispatch.status == 'sending') & (PrintDispatch.updated_at < stale_before)))
+                .order_by(PrintDispatch.id)
+                .with_for_update(skip_locked=True)
+                .first())
+    if dispatch is None:
+        db.session.rollback()
+        return None
+    dispatch.status = 'sending'
+    dispatch.attempts += 1
+    db.session.commit()
+    return dispatch
+
+def resume_payload(data, output_format, bytes_sent):
+    """
+    Return (payload, base): what to send to carry on after bytes_sent bytes got through, and the offset
+    in data that the end of the payload's header corresponds to. PDFs and IPP jobs always restart.
+    """
+    if bytes_sent == 0 or output_format == 'pdf':
+        return data, 0
+    header_end, offsets = label_offsets(data, output_format)
+    # Restart at the label that was cut off; the graphic is downloaded again in case the printer was reset
+    restart = max((offset for offset in offsets if offset <= bytes_sent), default=0)
+    if restart <= header_end:
+        return data, 0
+    return data[:header_end] + data[restart:], restart - header_end
+
+def send_dispatch(dispatch):
+    """Send one claimed dispatch, recording how far it got so a retry can resume."""
+    config = current_app.config
+    path = get_artifact(dispatch.artifact_id, dispatch.output_format)
+    if path is None:
+        raise PrinterError('The generated output is no longer available; please print again')
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    printer = dispatch.printer
+    with connection_pool.connection(printer, config['PRINT_DISPATCH_TIMEOUT'], config['PRINTER_IDLE_TIMEOUT']) as conn:
+        if printer.protocol == 'ipp':
+            conn.print_job(data, dispatch.output_format, f'stickers-{dispatch.artifact_id[:12]}')
+            return
+
+        payload, base = resume_payload(data, dispatch.output_format, dispatch.bytes_sent)
+        last_report = [time.monotonic()]
+
+        def record_progress(sent):
+            dispatch.bytes_sent = max(dispatch.bytes_sent, sent + base)
+            now = time.monotonic()
+            if now - last_report[0] >= 0.5:
+                last_report[0] = now
+                db.session.commit()
+
+        conn.send(payload, record_progress)
+        # Acknowledged is not printed: only count the job as sent once the printer has read all of it
+        conn.finish(config['PRINT_DISPATCH_DRAIN_TIMEOUT'])
+    dispatch.bytes_sent = len(data)
+
+def run_dispatch(dispatch):
+    """Send a claimed dispatch and record the outcome, scheduling a retry with backoff on failure."""
+    try:
+        send_dispatch(dispatch)
+        dispatch.status = 'sent'
+        dispatch.sent_at = datetime.utcnow()
+        dispatch.error = None
+    except Exception as e:
+        bytes_sent = dispatch.bytes_sent
+        db.session.rollback()
+        dispatch.bytes_sent = bytes_sent
+        dispatch.error = str(e)
+        if dispatch.attempts >= current_app.config['PRINT_DISPATCH_MAX_ATTEMPTS']:
+            dispatch.status = 'failed'
+            current_app.logger.error(f'Print dispatch {dispatch.id} failed: {str(e)}')
+        else:
+            dispatch.status = 'queued'
+            dispatch.next_attempt_at = datetime.utcnow() + timedelta(seconds=min(60, 2 ** dispatch.attempts))
+            current_app.logger.warning(f'Print dispatch {dispatch.id} attempt {dispatch.attempts} failed, retrying: {str(e)}')
+    db.session.commit()
+
+def dispatch_once():
+    """Claim and send a single dispatch; returns False when nothing was due."""
+    dispatch = claim_next_dispatch()
+    if dispatch is None:
+        return False
+    run_dispatch(dispatch)
+    return True
+
+def start_dispatch_workers(app, count=None):
+    """Start count daemon dispatch threads in this process (PRINT_DISPATCH_WORKERS by default). Safe to call repeatedly."""
+    from app.print_queue import worker_loop
+    count = app.config['PRINT_DISPATCH_WORKERS'] if count is None else count
+    with _workers_lock:
+        while len(_workers) < count:
+            worker = threading.Thread(target=worker_loop, args=(app, None, dispatch_once),
+                                      name=f'print-dispatch-{len(_workers)}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+def check_printer(printer, timeout=3):
+    """Open a connection to the printer's port; raises PrinterError if it cannot be reached."""
+    try:
+        socket.create_connection((printer.host, printer.port), timeout=timeout).close()
+    except OSError as e:
+        raise PrinterError(f'Could not connect to {printer.host}:{printer.port}: {str(e)}')
@@ -0,0 +1,213 @@
+"""
+Postgres-backed queue for sticker PDF renders.
+Print routes enqueue a RenderJob and return at once; worker threads claim jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of web or worker processes can share the queue.
+A worker takes the oldest job at once, along with any jobs for the same output and printer that are
+already waiting behind it, and renders them in one pass over a single loaded design. Nothing waits to
+be batched: batches form only when jobs queue up faster than the workers take them.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models import RenderJob
+from app.sticker import Sticker, StickerRun, create_stickers_pdf, load_sticker_layout
+from app.label_printer import LABEL_LANGUAGES, create_label_output
+
+# PDF for browser printing, or a printer command language for label printers
+OUTPUT_FORMATS = ('pdf',) + LABEL_LANGUAGES
+
+# Postgres advisory lock held by enqueue_render_job until the caller's transaction ends
+ENQUEUE_LOCK_KEY = 0x53544B52
+
+class QueueFullError(Exception):
+    """Raised when a render job is refused for backpressure; the message is shown to the user."""
+
+_workers = []
+_workers_lock = threading.Lock()
+
+def serialize_runs(runs):
+    return [{'sticker': sticker.to_dict(), 'count': count} for sticker, count in runs]
+
+def deserialize_runs(payload):
+    return [StickerRun(Sticker.from_dict(run['sticker']), run['count']) for run in payload]
+
+def render_output(runs, output_format='pdf', progress=None, printer_copies=False, layout=None):
+    """
+    Render runs in one of OUTPUT_FORMATS into the artifact cache and return the artifact id.
+    printer_copies only applies to PDFs; ZPL and TSPL always leave the copies to the printer.
+    """
+    if output_format == 'pdf':
+        return create_stickers_pdf(runs, progress=progress, printer_copies=printer_copies, layout=layout)
+    return create_label_output(runs, output_format, progress=progress, layout=layout)
+
+def enqueue_render_job(user_id, runs, output_format='pdf', printer_copies=False, printer_id=None):
+    """
+    Queue a render of these runs for user_id and return the RenderJob (added to the session, not committed).
+    Raises QueueFullError when the queue or the user's share of it is full.
+
+    On Postgres the limits are checked under a transaction-level advisory lock, so concurrent enqueues
+    take turns and each one counts the jobs committed before it; the caller must commit or roll back
+    promptly to release it.
+    """
+    config = current_app.config
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.select(db.func.pg_advisory_xact_lock(ENQUEUE_LOCK_KEY)))
+    queued = RenderJob.query.filter_by(status='queued').count()
+    if queued >= config['RENDER_QUEUE_MAX_DEPTH']:
+        raise QueueFullError('The print queue is full. Please try again in a moment.')
+
+    active = RenderJob.query.filter(RenderJob.user_id == user_id,
+                                    RenderJob.status.in_(('queued', 'running'))).count()
+    if active >= config['RENDER_JOBS_PER_USER']:
+        raise QueueFullError('You already have print jobs in progress. Please wait for them to finish.')
+
+    job = RenderJob(
+        user_id=user_id,
+        payload=serialize_runs(runs),
+        output_format=output_format,
+        printer_copies=printer_copies,
+        printer_id=printer_id,
+        total=sum(count for _, count in runs)
+    )
+    db.session.add(job)
+    return job
+
+def claim_next_batch():
+    """
+    Claim the oldest queued job, together with up to RENDER_BATCH_MAX_JOBS - 1 other jobs already
+    queued for the same output format and printer, and mark them all running. Returns the jobs oldest
+    first, or an empty list if there is nothing to do.
+    Jobs left running by a worker that died are picked up again after RENDER_JOB_TIMEOUT seconds.
+    """
+    config = current_app.config
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=config['RENDER_JOB_TIMEOUT'])
+    first = (RenderJob.query
+             .filter((RenderJob.status == 'queued') |
+                     ((RenderJob.status == 'running') & (RenderJob.updated_at < stale_before)))
+             .order_by(RenderJob.id)
+             .with_for_update(skip_locked=True)
+             .first())
+    if first is None:
+        db.session.rollback()
+        return []
+    jobs = [first]
+    if config['RENDER_BATCH_MAX_JOBS'] > 1:
+        jobs += (RenderJob.query
+                 .filter(RenderJob.status == 'queued',
+                         RenderJob.id != first.id,
+                         RenderJob.output_format == first.output_format,
+                         RenderJob.printer_copies == first.printer_copies,
+                         RenderJob.printer_id == first.printer_id)
+                 .order_by(RenderJob.id)
+                 .limit(config['RENDER_BATCH_MAX_JOBS'] - 1)
+                 .with_for_update(skip_locked=True)
+                 .all())
+    for job in jobs:
+        job.status = 'running'
+        job.progress = 0
+        job.started_at = now
+        job.batch_id = first.id
+    db.session.commit()
+    return jobs
+
+def run_render_job(job, layout=None):
+    """Render a claimed job into the artifact cache, recording progress and the outcome on the job."""
+    last_report = [time.monotonic()]
+
+    def report_progress(done):
+        # Progress is only for the status endpoint, so write it at most twice a second
+        now = time.monotonic()
+        if now - last_report[0] >= 0.5:
+            last_report[0] = now
+            job.progress = done
+            db.session.commit()
+
+    try:
+        job.artifact_id = render_output(deserialize_runs(job.payload), job.output_format, progress=report_progress,
+                                        printer_copies=job.printer_copies, layout=layout)
+        job.progress = job.total
+        job.status = 'done'
+        if job.printer is not None:
+            from app.print_dispatch import enqueue_dispatch
+            enqueue_dispatch(job.printer, job.artifact_id, job.output_format, render_job_id=job.id)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Render job {job.id} failed: {str(e)}')
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+def run_render_batch(jobs):
+    """
+    Render claimed jobs one after another with the design loaded once. Each job still gets its own
+    artifact and outcome; the batch size and how long its jobs waited are logged.
+    """
+    started = time.monotonic()
+    try:
+        layout = load_sticker_layout()
+    except Exception as e:
+        # Each job then loads the design itself and fails with the error on its own
+        current_app.logger.error(f'Could not load the sticker design for batch {jobs[0].id}: {str(e)}')
+        layout = None
+    waits = [(job.started_at - job.created_at).total_seconds() for job in jobs]
+    for job in jobs:
+        run_render_job(job, layout)
+    current_app.logger.info(f'Render batch {jobs[0].id}: {len(jobs)} job(s), waited up to {max(waits):.2f} s, '
+                            f'rendered in {time.monotonic() - started:.2f} s')
+
+def work_once():
+    """Claim and run a single batch; returns False when the queue was empty."""
+    jobs = claim_next_batch()
+    if not jobs:
+        return False
+    run_render_batch(jobs)
+    return True
+
+def batch_metrics(since):
+    """Batch count, sizes and queue wait times (seconds) of jobs claimed since the given datetime."""
+    jobs = (RenderJob.query
+            .filter(RenderJob.batch_id.isnot(None), RenderJob.started_at >= since)
+            .with_entities(RenderJob.batch_id, RenderJob.created_at, RenderJob.started_at)
+            .all())
+    sizes = {}
+    for batch_id, _, _ in jobs:
+        sizes[batch_id] = sizes.get(batch_id, 0) + 1
+    waits = [(started_at - created_at).total_seconds() for _, created_at, started_at in jobs]
+    return {
+        'batches': len(sizes),
+        'jobs': len(jobs),
+        'avg_batch_size': round(len(jobs) / len(sizes), 2) if sizes else 0,
+        'max_batch_size': max(sizes.values(), default=0),
+        'avg_wait_seconds': round(sum(waits) / len(waits), 3) if waits else 0,
+        'max_wait_seconds': round(max(waits, default=0), 3)
+    }
+
+def worker_loop(app, stop_event=None, work=work_once):
+    """
+    Call work() until stop_event is set, sleeping RENDER_POLL_INTERVAL seconds whenever it reports an empty queue.
+    Shared by the render and print dispatch workers.
+    """
+    interval = app.config['RENDER_POLL_INTERVAL']
+    while stop_event is None or not stop_event.is_set():
+        with app.app_context():
+            try:
+                busy = work()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f'{threading.current_thread().name} error: {str(e)}')
+                busy = False
+        if not busy:
+            time.sleep(interval)
+
+def start_render_workers(app, count=None):
+    """Start count daemon worker threads in this process (RENDER_WORKERS by default). Safe to call repeatedly."""
+    count = app.config['RENDER_WORKERS'] if count is None else count
+    with _workers_lock:
+        while len(_workers) < count:
+            worker = threading.Thread(target=worker_loop, args=(app,), name=f'render-worker-{len(_workers)}', daemon=True)
+            worker.start()
+            _workers.append(worker)
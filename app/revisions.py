@@ -0,0 +1,58 @@
+"""
+Product revisions: immutable snapshots of the fields printed on a product's stickers.
+A revision is identified by a sha256 of that content, so it is recorded once per distinct version
+of a product. Print jobs reference the revision they printed, and rendered output is cached on the
+hash rather than on every text field.
+"""
+import hashlib
+import json
+from decimal import Decimal
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import ProductRevision
+
+# Product fields that appear on a sticker; shelf life only sets the default expiry date
+PRODUCT_REVISION_FIELDS = ('name', 'rate', 'net_weight', 'ingredients', 'nutritional_facts', 'allergen_information')
+
+def product_content(product):
+    content = {field: getattr(product, field) or '' for field in PRODUCT_REVISION_FIELDS}
+    content['rate'] = f'{Decimal(product.rate):.2f}'
+    return content
+
+def content_hash(content):
+    payload = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def current_revisions(products):
+    """
+    Return {product id: ProductRevision} for the current content of each product, creating revisions
+    for content not seen before. New revisions are flushed, not committed.
+    """
+    contents = {product.id: product_content(product) for product in products}
+    hashes = {product_id: content_hash(content) for product_id, content in contents.items()}
+    if not hashes:
+        return {}
+
+    revisions = {}
+    for revision in ProductRevision.query.filter(ProductRevision.product_id.in_(hashes.keys()),
+                                                 ProductRevision.content_hash.in_(set(hashes.values()))):
+        if hashes[revision.product_id] == revision.content_hash:
+            revisions[revision.product_id] = revision
+
+    for product_id, digest in hashes.items():
+        if product_id in revisions:
+            continue
+        revision = ProductRevision(product_id=product_id, content_hash=digest, **contents[product_id])
+        try:
+            with db.session.begin_nested():
+                db.session.add(revision)
+        except IntegrityError:
+            # Recorded at the same moment by another request
+            revision = ProductRevision.query.filter_by(product_id=product_id, content_hash=digest).one()
+        revisions[product_id] = revision
+    return revisions
+
+def record_product_revision(product):
+    """Snapshot a product that was just created or changed."""
+    current_revisions([product])
+    db.session.commit()
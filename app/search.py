@@ -0,0 +1,64 @@
+"""
+Name search for products and categories, shared by the product list, the print typeahead and
+the category picker. Names starting with the term are found first through a btree index on
+lower(name); when there are fewer than the limit, the rest are names containing the term or close
+to it, found through pg_trgm GIN indexes and ranked by word similarity.
+"""
+from flask import current_app
+from sqlalchemy import func, literal, or_, text
+from app import db
+from app.models import Product, ProductCategory
+
+# Trigram matching needs at least this many characters; shorter terms only match as a prefix
+MIN_TRIGRAM_TERM = 3
+
+def ensure_trigram_extension():
+    """Create pg_trgm if it is missing, before migrations build the trigram indexes or searches use them."""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_by_name(model, term, limit=None, options=()):
+    """Return up to limit rows of model (SEARCH_RESULT_LIMIT by default) whose name matches term, best first."""
+    term = (term or '').strip()
+    if not term:
+        return []
+    limit = limit or current_app.config['SEARCH_RESULT_LIMIT']
+    name = model.name
+    pattern = _escape_like(term)
+
+    # Fast path: prefix matches in name order
+    results = (model.query.options(*options)
+               .filter(func.lower(name).like(pattern.lower() + '%', escape='\\'))
+               .order_by(func.lower(name))
+               .limit(limit)
+               .all())
+    if len(results) >= limit or len(term) < MIN_TRIGRAM_TERM:
+        return results
+
+    query = (model.query.options(*options)
+             .filter(or_(name.ilike(f'%{pattern}%', escape='\\'),
+                         literal(term).op('<%')(name))))
+    if results:
+        query = query.filter(model.id.notin_([row.id for row in results]))
+    return results + (query.order_by(func.word_similarity(term, name).desc(), name)
+                      .limit(limit - len(results))
+                      .all())
+
+def find_products(term, limit=None):
+    return search_by_name(Product, term, limit, options=(db.joinedload(Product.category),))
+
+def find_categories(term, limit=None):
+    return search_by_name(ProductCategory, term, limit)
+
+def category_product_counts(category_ids):
+    """Number of products in each category, from one grouped COUNT rather than loading category.products."""
+    if not category_ids:
+        return {}
+    counts = dict(db.session.query(Product.category_id, func.count(Product.id))
+                  .filter(Product.category_id.in_(category_ids))
+                  .group_by(Product.category_id))
+    return {category_id: counts.get(category_id, 0) for category_id in category_ids}
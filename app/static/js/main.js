@@ -73,3 +73,104 @@ document.addEventListener('DOMContentLoaded', function() {
   updatePrinterSettings();
   updatePaperSizeSettings();
 });
+
+/**
+ * Submits a print request and follows the queued render job until its PDF is ready.
+ * The PDF tab is opened straight away (inside the click handler, so popup blockers allow it)
+ * and pointed at the PDF once the job is done. When a printer is chosen no tab is opened;
+ * the job is followed until the printer has received it.
+ * @param {string} url - The print endpoint.
+ * @param {object} options - fetch() options for the request.
+ * @param {HTMLElement} statusElement - Element that shows queue progress.
+ * @param {string} [printerId] - Id of the printer to send the stickers to, if any.
+ * @returns {Promise<boolean>} Whether the stickers were generated.
+ */
+function submitPrintJob(url, options, statusElement, printerId) {
+  if (printerId) {
+      url += (url.includes('?') ? '&' : '?') + 'printer=' + encodeURIComponent(printerId);
+  }
+  // Sent with the request so that a resubmission cannot print the same stickers twice
+  const idempotencyKey = window.crypto && crypto.randomUUID
+      ? crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+  options.headers = Object.assign({}, options.headers, { 'Idempotency-Key': idempotencyKey });
+  const pdfWindow = printerId ? null : window.open('', '_blank');
+  if (pdfWindow) {
+      pdfWindow.document.title = 'Generating stickers...';
+      pdfWindow.document.body.textContent = 'Generating stickers...';
+  }
+
+  const showStatus = (text) => {
+      statusElement.textContent = text;
+      statusElement.style.display = 'block';
+  };
+
+  const fail = (message) => {
+      if (pdfWindow) {
+          pdfWindow.close();
+      }
+      alert(message);
+      return false;
+  };
+
+  const poll = (statusUrl) => fetch(statusUrl)
+      .then(response => response.json())
+      .then(job => {
+          if (job.status === 'done' && printerId) {
+              if (job.dispatch_status === 'sent') {
+                  showStatus(`Stickers have been sent to ${job.printer}.`);
+                  window.scrollTo(0, 0);
+                  return true;
+              }
+              if (job.dispatch_status === 'failed') {
+                  return fail(job.message);
+              }
+              showStatus(`Sending stickers to ${job.printer}...`);
+          } else if (job.status === 'done') {
+              if (pdfWindow) {
+                  pdfWindow.location = job.pdf_url;
+              } else {
+                  window.open(job.pdf_url, '_blank');
+              }
+              showStatus('Stickers have been generated successfully!');
+              window.scrollTo(0, 0);
+              return true;
+          } else if (job.status === 'failed') {
+              return fail(job.message);
+          } else if (job.status === 'queued') {
+              showStatus(`Waiting in the print queue (position ${job.queue_position})...`);
+          } else {
+              showStatus(`Generating stickers: ${job.progress} of ${job.total}...`);
+          }
+          return new Promise(resolve => setTimeout(resolve, 1000)).then(() => poll(statusUrl));
+      });
+
+  // Network failures and requests still being handled are retried with the same key,
+  // so the server returns the original job instead of printing again
+  const send = (attempt) => fetch(url, options)
+      .then(response => {
+          if (response.status === 409 && attempt < 5) {
+              return new Promise(resolve => setTimeout(resolve, 2000)).then(() => send(attempt + 1));
+          }
+          return response;
+      }, error => {
+          if (attempt >= 2) {
+              throw error;
+          }
+          return new Promise(resolve => setTimeout(resolve, 1000)).then(() => send(attempt + 1));
+      });
+
+  return send(0)
+      .then(response => response.json().then(data => ({ status: response.status, data: data })))
+      .then(({ status, data }) => {
+          if (status !== 202) {
+              return fail(data.message || 'An error occurred while generating the stickers.');
+          }
+          showStatus(data.message);
+          return poll(data.status_url);
+      })
+      .catch(error => {
+          console.error('Error generating stickers:', error);
+          return fail('An error occurred while generating the stickers.');
+      });
+}
@@ -1,18 +1,32 @@
+import copy
+import json
+import logging
 import os
 import re
+import threading
+import time
+from collections import namedtuple
+from datetime import date
+from functools import lru_cache
 from flask import current_app
 from reportlab.lib.pagesizes import mm, A4, A5, landscape
 from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.utils import ImageReader
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.platypus import Paragraph
 from reportlab.lib.colors import black
+from reportlab.pdfbase.pdfdoc import ViewerPreferencesPDFDictionary
 from app.models import StickerDesign, StoreInfo
+from app.fonts import REGULAR_FONT, SEMIBOLD_FONT, BOLD_FONT
+from app.images import prepare_image
+from app.artifacts import artifact_id_for, get_artifact, write_artifact
 
 class Sticker:
-    def __init__(self, product_name, rate, mfg_date, exp_date, net_weight, ingredients, nutritional_facts, batch_number, allergen_information):
+    __slots__ = ('product_name', 'rate', 'mfg_date', 'exp_date', 'net_weight', 'ingredients',
+                 'nutritional_facts', 'batch_number', 'allergen_information', 'revision')
+
+    def __init__(self, product_name, rate, mfg_date, exp_date, net_weight, ingredients, nutritional_facts, batch_number, allergen_information,
+                 revision=None):
         self.product_name = product_name
         self.rate = rate
         self.mfg_date = mfg_date
@@ -22,6 +36,51 @@ class Sticker:
         self.nutritional_facts = nutritional_facts
         self.batch_number = batch_number
         self.allergen_information = allergen_information
+        self.revision = revision  # Content hash of the product revision the product fields came from
+
+    @classmethod
+    def from_revision(cls, revision, mfg_date, exp_date, batch_number):
+        """Sticker for a ProductRevision; its content hash stands in for the product fields in key()."""
+        return cls(
+            product_name=revision.name,
+            rate=str(revision.rate),  # Convert Decimal to string for sticker
+            mfg_date=mfg_date,
+            exp_date=exp_date,
+            net_weight=revision.net_weight,
+            ingredients=revision.ingredients,
+            nutritional_facts=revision.nutritional_facts,
+            batch_number=batch_number,
+            allergen_information=revision.allergen_information,
+            revision=revision.content_hash
+        )
+
+    def key(self):
+        """
+        Return the printed fields as a tuple; stickers with equal keys render identically.
+        Stickers made from a product revision are keyed by its content hash rather than the text fields.
+        """
+        if self.revision:
+            return (self.revision, self.mfg_date, self.exp_date, self.batch_number)
+        return (self.product_name, self.rate, self.mfg_date, self.exp_date, self.net_weight,
+                self.ingredients, self.nutritional_facts, self.batch_number, self.allergen_information)
+
+    def to_dict(self):
+        """JSON-safe form of the sticker, used to queue render jobs."""
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['mfg_date'] = self.mfg_date.isoformat()
+        data['exp_date'] = self.exp_date.isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data['mfg_date'] = date.fromisoformat(data['mfg_date'])
+        data['exp_date'] = date.fromisoformat(data['exp_date'])
+        return cls(**data)
+
+# `count` identical copies of one sticker. Print jobs are carried as lists of runs end to end,
+# so memory depends on the number of products in an order, not on the label count.
+StickerRun = namedtuple('StickerRun', ['sticker', 'count'])
 
 def get_page_size(design):
     if design.printer_type == 'label':
@@ -37,164 +96,428 @@ def get_page_size(design):
         return landscape(page_size)
     return page_size
 
-def create_sticker_pdf(stickers, pdf_output):
+# One immutable drawing instruction. Coordinates are absolute points from the sticker origin;
+# `field` names the source of the text (None when `text` is a fixed string from the design).
+# `rich` marks fields whose position opts into Paragraph markup; everything else takes the plain-text path.
+DrawOp = namedtuple('DrawOp', ['kind', 'field', 'text', 'x', 'y', 'max_width', 'font_size', 'font_name', 'rich'])
+
+LayoutPlan = namedtuple('LayoutPlan', ['key', 'page_size', 'printer_type', 'width', 'height', 'margin',
+                                       'bg_image', 'store_ops', 'product_ops'])
+
+# Store fields in drawing order: (print toggle, StoreInfo attribute, position attribute, label, font)
+STORE_FIELDS = [
+    ('print_store_name', 'name', 'store_name_position', '{}', BOLD_FONT),
+    ('print_store_address', 'address', 'store_address_position', '{}', REGULAR_FONT),
+    ('print_store_phone', 'phone_number', 'store_phone_position', 'Phone: {}', REGULAR_FONT),
+    ('print_store_gst', 'gst_number', 'store_gst_position', 'GST: {}', REGULAR_FONT),
+    ('print_store_fssai', 'fssai_number', 'store_fssai_position', 'FSSAI: {}', REGULAR_FONT),
+    ('print_store_email', 'email', 'store_email_position', 'Email: {}', REGULAR_FONT),
+]
+
+# Product text blocks with an optional heading: (heading toggle, sticker attribute, position attribute, heading prefix)
+PRODUCT_BLOCKS = [
+    ('print_nutritional_heading', 'nutritional_facts', 'nutritional_facts_position', 'nutritional'),
+    ('print_allergen_heading', 'allergen_information', 'allergen_info_position', 'allergen'),
+    ('print_ingredients_heading', 'ingredients', 'ingredients_position', 'ingredients'),
+]
+
+def _mrp_text(sticker):
+    usp_rate = round(float(sticker.rate) / float(sticker.net_weight), 2)
+    return f"MRP: ₹{sticker.rate}   (₹{usp_rate:.2f}/g)"
+
+# How each product field of a Sticker becomes printed text
+PRODUCT_FIELD_TEXT = {
+    'product_name': lambda sticker: sticker.product_name.upper(),
+    'mrp': _mrp_text,
+    'net_weight': lambda sticker: "Net Weight: " + sticker.net_weight + "g",
+    'mfg_date': lambda sticker: "MFG Date: " + sticker.mfg_date.strftime('%d-%m-%Y'),
+    'exp_date': lambda sticker: "EXP Date: " + sticker.exp_date.strftime('%d-%m-%Y'),
+    'batch_number': lambda sticker: "Batch No: " + sticker.batch_number,
+    'nutritional_facts': lambda sticker: sticker.nutritional_facts.split("\n"),
+    'allergen_information': lambda sticker: sticker.allergen_information.split("\n"),
+    'ingredients': lambda sticker: sticker.ingredients.split("\n"),
+}
+
+# Process-level caches, keyed by design (and store info) version. Request, render and dispatch threads
+# share them, so they are only cleared or filled under _design_cache_lock
+_layout_plans = {}
+_store_layers = {}
+_design_cache_lock = threading.Lock()
+
+def compile_layout(design):
+    """
+    Compile a StickerDesign row into a LayoutPlan with absolute coordinates and resolved font sizes.
+    Raises ValueError if the design cannot be drawn.
+    """
+    width, height = design.page_size['width'] * mm, design.page_size['height'] * mm
+    margin = design.page_size['margin'] * mm
+    # Apply margin to the content
+    content_x, content_top = margin, height - margin
+
+    def place(position_name, top_offset=0):
+        position = getattr(design, position_name)
+        return (content_x + position['left']*mm, content_top - (position['top'] + top_offset)*mm, position['max_width']*mm,
+                bool(position.get('rich', False)))
+
+    store_ops = []
+    if design.print_store_logo:
+        x, y, max_width, rich = place('store_logo_position')
+        store_ops.append(DrawOp('logo', 'logo', None, x, y, max_width, None, None, False))
+    for toggle, field, position_name, label, font_name in STORE_FIELDS:
+        if getattr(design, toggle):
+            x, y, max_width, rich = place(position_name)
+            font_size = getattr(design, position_name).get('font_size', design.content_font_size)
+            store_ops.append(DrawOp('text', field, label, x, y, max_width, font_size, font_name, rich))
+
+    product_ops = []
+    x, y, max_width, rich = place('product_name_position')
+    product_ops.append(DrawOp('text', 'product_name', None, x, y, max_width, design.product_name_position.get('font_size', design.heading_font_size), BOLD_FONT, rich))
+    for field, position_name in [('mrp', 'mrp_position'), ('net_weight', 'net_weight_position'), ('mfg_date', 'mfg_date_position'),
+                                 ('exp_date', 'exp_date_position'), ('batch_number', 'batch_no_position')]:
+        x, y, max_width, rich = place(position_name)
+        product_ops.append(DrawOp('text', field, None, x, y, max_width, getattr(design, position_name).get('font_size', design.content_font_size), REGULAR_FONT, rich))
+
+    for toggle, field, position_name, heading in PRODUCT_BLOCKS:
+        font_size = getattr(design, position_name).get('font_size', design.content_font_size)
+        if getattr(design, toggle):
+            heading_text = getattr(design, f'{heading}_heading_text')
+            heading_font_size = getattr(design, f'{heading}_heading_font_size')
+            x, y, max_width, rich = place(position_name)
+            if heading == 'nutritional':
+                if len(heading_text.split('\n')) != 2:
+                    raise ValueError("Nutritional heading must have exactly two lines")
+                product_ops.append(DrawOp('nutritional_heading', None, heading_text, x, y, max_width, heading_font_size, SEMIBOLD_FONT, rich))
+            else:
+                product_ops.append(DrawOp('text', None, heading_text, x, y, max_width, heading_font_size, SEMIBOLD_FONT, rich))
+            x, y, max_width, rich = place(position_name, top_offset=font_size*0.7)
+        else:
+            x, y, max_width, rich = place(position_name)
+        product_ops.append(DrawOp('lines', field, None, x, y, max_width, font_size, REGULAR_FONT, rich))
+
+    bg_image = design.bg_image if design.use_bg_image and design.bg_image else None
+    return LayoutPlan((design.id, design.updated_at), get_page_size(design), design.printer_type, width, height, margin,
+                      bg_image, tuple(store_ops), tuple(product_ops))
+
+def get_layout_plan(design):
+    """Return the cached LayoutPlan for this design version, compiling it on a version change."""
+    key = (design.id, design.updated_at)
+    plan = _layout_plans.get(key)
+    if plan is None:
+        plan = compile_layout(design)
+        with _design_cache_lock:
+            # Only the current version is ever needed; drop plans left behind by other workers' saves
+            _layout_plans.clear()
+            _layout_plans[key] = plan
+    return plan
+
+def execute_op(c, op, text):
+    if op.kind == 'text':
+        draw_wrapped_text(c, text, op.x, op.y, max_width=op.max_width, font_size=op.font_size, font_name=op.font_name, rich=op.rich)
+    elif op.kind == 'lines':
+        draw_multiline_text(c, text, op.x, op.y, max_width=op.max_width, font_size=op.font_size, font_name=op.font_name, rich=op.rich)
+    elif op.kind == 'nutritional_heading':
+        draw_nutritional_heading(c, text, op.x, op.y, max_width=op.max_width, font_size=op.font_size, font_name=op.font_name)
+
+class StoreLayer:
+    """
+    Static part of every sticker: white ground, background image, store logo and store details.
+    Built from a LayoutPlan and StoreInfo, so drawing needs no DB access or image file I/O.
+    """
+    def __init__(self, plan, store_info, static_root, image_dpi):
+        self.width, self.height, self.margin = plan.width, plan.height, plan.margin
+        self.bg_image = None
+        if plan.bg_image:
+            bg_image_path = os.path.join(static_root, plan.bg_image)
+            if os.path.exists(bg_image_path):
+                self.bg_image = prepare_image(bg_image_path, self.width - 2*self.margin, self.height - 2*self.margin, image_dpi)
+
+        self.logo = None
+        self.texts = []
+        if not store_info:
+            return
+
+        for op in plan.store_ops:
+            if op.kind == 'logo':
+                # Draw store logo if available
+                if store_info.logo:
+                    logo_path = os.path.join(static_root, store_info.logo)
+                    if os.path.exists(logo_path):
+                        logo = prepare_image(logo_path, op.max_width, None, image_dpi)
+                        # Calculate height while maintaining aspect ratio
+                        logo_height = op.max_width * logo.aspect
+                        self.logo = (logo, op.x, op.y - logo_height, op.max_width, logo_height)
+            else:
+                value = getattr(store_info, op.field)
+                if value:
+                    self.texts.append((op, op.text.format(value)))
+
+    def draw(self, c):
+        # Draw a white rectangle as the sticker background (including margins)
+        c.setFillColorRGB(1, 1, 1)  # White color
+        c.rect(0, 0, self.width, self.height, fill=True, stroke=False)
+
+        # Draw the background image if it exists (only for the sticker area, excluding margins)
+        if self.bg_image:
+            c.drawImage(self.bg_image.reader(), self.margin, self.margin, width=self.width - 2*self.margin, height=self.height - 2*self.margin)
+
+        if self.logo:
+            logo, logo_x, logo_y, logo_width, logo_height = self.logo
+            c.drawImage(logo.reader(), logo_x, logo_y, width=logo_width, height=logo_height)
+
+        for op, text in self.texts:
+            execute_op(c, op, text)
+
+def get_store_layer(plan):
+    """Return the cached store layer for this plan and the current store info, building it on a version change."""
+    store_info = StoreInfo.query.first()
+    image_dpi = current_app.config['STICKER_IMAGE_DPI']
+    # The image resolution is part of the key, so output artifacts rendered at another DPI are not reused
+    key = (plan.key, store_info and store_info.id, store_info and store_info.updated_at, image_dpi)
+    layer = _store_layers.get(key)
+    if layer is None:
+        layer = StoreLayer(plan, store_info, os.path.join(current_app.root_path, 'static'), image_dpi)
+        layer.key = key
+        with _design_cache_lock:
+            _store_layers.clear()
+            _store_layers[key] = layer
+    return layer
+
+def load_sticker_layout():
+    """Return (plan, store layer) for the current sticker design and store info."""
     design = StickerDesign.query.first()
     if not design:
         raise ValueError("Sticker design not found in the database")
+    plan = get_layout_plan(design)
+    return plan, get_store_layer(plan)
+
+def warm_sticker_caches():
+    """Compile the current layout plan and store layer, pre-scaling the logo and background images."""
+    if StickerDesign.query.first():
+        load_sticker_layout()
+
+def invalidate_design_caches():
+    """Drop cached layout plans and store layers; called when the sticker design or store info is saved."""
+    with _design_cache_lock:
+        _layout_plans.clear()
+        _store_layers.clear()
+
+class StickerViewerPreferences(ViewerPreferencesPDFDictionary):
+    """reportlab's viewer preferences plus the PDF 1.7 print dialog presets."""
+    validate = dict(
+        ViewerPreferencesPDFDictionary.validate,
+        NumCopies=lambda value: value if isinstance(value, int) and value > 0 else None,
+        PickTrayByPDFSize=lambda value: value if value in ('true', 'false') else None,
+    )
 
-    PAGE_WIDTH, PAGE_HEIGHT = get_page_size(design)
-    STICKER_WIDTH, STICKER_HEIGHT = design.page_size['width'] * mm, design.page_size['height'] * mm
-    MARGIN = design.page_size['margin'] * mm
+def create_sticker_pdf(runs, pdf_output, layout=None, progress=None, num_copies=None):
+    """
+    Render a list of StickerRun into pdf_output (a path or file-like object).
+    If given, progress is called with the number of stickers placed so far, and num_copies
+    presets the copy count in the viewer's print dialog.
+    """
+    plan, store_layer = layout or load_sticker_layout()
+    PAGE_WIDTH, PAGE_HEIGHT = plan.page_size
+    STICKER_WIDTH, STICKER_HEIGHT = plan.width, plan.height
 
     c = canvas.Canvas(pdf_output, pagesize=(PAGE_WIDTH, PAGE_HEIGHT))
-    
-    if design.use_bg_image and design.bg_image:
-        bg_image_path = os.path.join(current_app.root_path, 'static', design.bg_image)
-        bg_image = ImageReader(bg_image_path)
-    else:
-        bg_image = None
+    if num_copies:
+        preferences = c._doc.Catalog.ViewerPreferences = StickerViewerPreferences()
+        preferences['NumCopies'] = num_copies
+        # Print labels at their real size on the label stock
+        preferences['PrintScaling'] = 'None'
+        preferences['PickTrayByPDFSize'] = 'true'
 
-    regular_font_path = os.path.join(current_app.root_path, 'static', 'fonts', 'RobotoCondensed-Bold.ttf')
-    pdfmetrics.registerFont(TTFont('RobotoCondensed', regular_font_path))
+    # The store layer is identical on every sticker, so it becomes a single form shared by all of them
+    c.beginForm('store_layer', 0, 0, STICKER_WIDTH, STICKER_HEIGHT)
+    store_layer.draw(c)
+    c.endForm()
 
-    if design.printer_type == 'label':
-        for sticker in stickers:
-            c.saveState()
-            draw_sticker(c, sticker, STICKER_WIDTH, STICKER_HEIGHT, bg_image, design, 0, 0)
-            c.restoreState()
-            c.showPage()
-    else:
-        x, y = 0, PAGE_HEIGHT - STICKER_HEIGHT
-        for sticker in stickers:
-            if y < 0:
-                c.showPage()
-                x, y = 0, PAGE_HEIGHT - STICKER_HEIGHT
+    # Each distinct sticker is drawn once into a form XObject; copies just reference it
+    forms = {}
 
-            c.saveState()
-            draw_sticker(c, sticker, STICKER_WIDTH, STICKER_HEIGHT, bg_image, design, x, y)
-            c.restoreState()
+    def stamp_sticker(sticker, x, y):
+        key = sticker.key()
+        form_name = forms.get(key)
+        if form_name is None:
+            form_name = forms[key] = f'sticker{len(forms)}'
+            c.beginForm(form_name, 0, 0, STICKER_WIDTH, STICKER_HEIGHT)
+            c.doForm('store_layer')
+            draw_sticker(c, sticker, plan)
+            c.endForm()
+        c.saveState()
+        c.translate(x, y)
+        c.doForm(form_name)
+        c.restoreState()
 
-            x += STICKER_WIDTH
-            if x + STICKER_WIDTH > PAGE_WIDTH:
-                x = 0
-                y -= STICKER_HEIGHT
+    done = 0
+    if plan.printer_type == 'label':
+        for sticker, count in runs:
+            for _ in range(count):
+                stamp_sticker(sticker, 0, 0)
+                c.showPage()
+                done += 1
+                if progress:
+                    progress(done)
+    else:
+        positions = grid_positions(plan)
+        for sticker, count in runs:
+            for _ in range(count):
+                x, y, new_page = next(positions)
+                if new_page and done:
+                    c.showPage()
+
+                stamp_sticker(sticker, x, y)
+                done += 1
+                if progress:
+                    progress(done)
 
         c.showPage()
 
     c.save()
 
-def draw_sticker(c, sticker, width, height, bg_image, design, x, y):
-    margin = design.page_size['margin'] * mm
+def grid_positions(plan):
+    """Yield (x, y, starts_new_page) for consecutive stickers on a sheet printer, filling rows top to bottom."""
+    PAGE_WIDTH, PAGE_HEIGHT = plan.page_size
+    STICKER_WIDTH, STICKER_HEIGHT = plan.width, plan.height
+    x, y = 0, PAGE_HEIGHT - STICKER_HEIGHT
+    new_page = True
+    while True:
+        if y < 0:
+            x, y = 0, PAGE_HEIGHT - STICKER_HEIGHT
+            new_page = True
 
-    # Draw a white rectangle as the sticker background (including margins)
-    c.setFillColorRGB(1, 1, 1)  # White color
-    c.rect(x, y, width, height, fill=True, stroke=False)
-    
-    # Draw the background image if it exists (only for the sticker area, excluding margins)
-    if bg_image:
-        c.drawImage(bg_image, x + margin, y + margin, width=width - 2*margin, height=height - 2*margin)
+        yield x, y, new_page
+        new_page = False
 
-    # Apply margin to the content
-    content_x, content_y = x + margin, y + margin
-    content_width, content_height = width - 2 * margin, height - 2 * margin
+        x += STICKER_WIDTH
+        if x + STICKER_WIDTH > PAGE_WIDTH:
+            x = 0
+            y -= STICKER_HEIGHT
 
-    # Get store info
-    store_info = StoreInfo.query.first()
-    if store_info:
-        # Draw store logo if available and enabled
-        if store_info.logo and design.print_store_logo:
-            logo_path = os.path.join(current_app.root_path, 'static', store_info.logo)
-            if os.path.exists(logo_path):
-                logo_x = content_x + design.store_logo_position['left']*mm
-                logo_y = content_y + content_height - design.store_logo_position['top']*mm
-                logo_width = design.store_logo_position['max_width']*mm
-                # Calculate height while maintaining aspect ratio
-                logo_img = ImageReader(logo_path)
-                aspect = logo_img.getSize()[1] / float(logo_img.getSize()[0])
-                logo_height = logo_width * aspect
-                c.drawImage(logo_path, logo_x, logo_y - logo_height, width=logo_width, height=logo_height)
-
-        # Draw store info text if enabled
-        if store_info.name and design.print_store_name:
-            draw_wrapped_text(c, store_info.name, content_x + design.store_name_position['left']*mm, content_y + content_height - design.store_name_position['top']*mm, max_width=design.store_name_position['max_width']*mm, font_size=design.store_name_position.get('font_size', design.content_font_size), bold=True)
-        if store_info.address and design.print_store_address:
-            draw_wrapped_text(c, store_info.address, content_x + design.store_address_position['left']*mm, content_y + content_height - design.store_address_position['top']*mm, max_width=design.store_address_position['max_width']*mm, font_size=design.store_address_position.get('font_size', design.content_font_size))
-        if store_info.phone_number and design.print_store_phone:
-            draw_wrapped_text(c, f"Phone: {store_info.phone_number}", content_x + design.store_phone_position['left']*mm, content_y + content_height - design.store_phone_position['top']*mm, max_width=design.store_phone_position['max_width']*mm, font_size=design.store_phone_position.get('font_size', design.content_font_size))
-        if store_info.gst_number and design.print_store_gst:
-            draw_wrapped_text(c, f"GST: {store_info.gst_number}", content_x + design.store_gst_position['left']*mm, content_y + content_height - design.store_gst_position['top']*mm, max_width=design.store_gst_position['max_width']*mm, font_size=design.store_gst_position.get('font_size', design.content_font_size))
-        if store_info.fssai_number and design.print_store_fssai:
-            draw_wrapped_text(c, f"FSSAI: {store_info.fssai_number}", content_x + design.store_fssai_position['left']*mm, content_y + content_height - design.store_fssai_position['top']*mm, max_width=design.store_fssai_position['max_width']*mm, font_size=design.store_fssai_position.get('font_size', design.content_font_size))
-        if store_info.email and design.print_store_email:
-            draw_wrapped_text(c, f"Email: {store_info.email}", content_x + design.store_email_position['left']*mm, content_y + content_height - design.store_email_position['top']*mm, max_width=design.store_email_position['max_width']*mm, font_size=design.store_email_position.get('font_size', design.content_font_size))
-
-    # Convert dates to strings
-    mfg_date_str = sticker.mfg_date.strftime('%d-%m-%Y')
-    exp_date_str = sticker.exp_date.strftime('%d-%m-%Y')
-    usp_rate     = round(float(sticker.rate) / float(sticker.net_weight), 2)
-
-    # Draw product info
-    draw_wrapped_text(c, sticker.product_name.upper(), content_x + design.product_name_position['left']*mm, content_y + content_height - design.product_name_position['top']*mm, max_width=design.product_name_position['max_width']*mm, font_size=design.product_name_position.get('font_size', design.heading_font_size), bold=True)
-    draw_wrapped_text(c, f"MRP: ₹{sticker.rate}   (₹{usp_rate:.2f}/g)", content_x + design.mrp_position['left']*mm, content_y + content_height - design.mrp_position['top']*mm, max_width=design.mrp_position['max_width']*mm, font_size=design.mrp_position.get('font_size', design.content_font_size))
-    draw_wrapped_text(c, "Net Weight: " + sticker.net_weight + "g", content_x + design.net_weight_position['left']*mm, content_y + content_height - design.net_weight_position['top']*mm, max_width=design.net_weight_position['max_width']*mm, font_size=design.net_weight_position.get('font_size', design.content_font_size))
-    draw_wrapped_text(c, "MFG Date: " + mfg_date_str, content_x + design.mfg_date_position['left']*mm, content_y + content_height - design.mfg_date_position['top']*mm, max_width=design.mfg_date_position['max_width']*mm, font_size=design.mfg_date_position.get('font_size', design.content_font_size))
-    draw_wrapped_text(c, "EXP Date: " + exp_date_str, content_x + design.exp_date_position['left']*mm, content_y + content_height - design.exp_date_position['top']*mm, max_width=design.exp_date_position['max_width']*mm, font_size=design.exp_date_position.get('font_size', design.content_font_size))
-    draw_wrapped_text(c, "Batch No: " + sticker.batch_number, content_x + design.batch_no_position['left']*mm, content_y + content_height - design.batch_no_position['top']*mm, max_width=design.batch_no_position['max_width']*mm, font_size=design.batch_no_position.get('font_size', design.content_font_size))
-
-    # Nutritional Facts box
-    nutritional_lines = sticker.nutritional_facts.split("\n")
-    if design.print_nutritional_heading:
-        draw_nutritional_heading(c, design.nutritional_heading_text, content_x + design.nutritional_facts_position['left']*mm, content_y + content_height - design.nutritional_facts_position['top']*mm, max_width=design.nutritional_facts_position['max_width']*mm, font_size=design.nutritional_heading_font_size)
-        draw_multiline_text(c, nutritional_lines, content_x + design.nutritional_facts_position['left']*mm, content_y + content_height - (design.nutritional_facts_position['top'] + (design.nutritional_facts_position.get('font_size', design.content_font_size)*0.7))*mm, max_width=design.nutritional_facts_position['max_width']*mm, font_size=design.nutritional_facts_position.get('font_size', design.content_font_size))
-    else:
-        draw_multiline_text(c, nutritional_lines, content_x + design.nutritional_facts_position['left']*mm, content_y + content_height - design.nutritional_facts_position['top']*mm, max_width=design.nutritional_facts_position['max_width']*mm, font_size=design.nutritional_facts_position.get('font_size', design.content_font_size))
+def stickers_per_page(plan):
+    """Number of stickers that fill one page of output."""
+    if plan.printer_type == 'label':
+        return 1
+    positions = grid_positions(plan)
+    next(positions)
+    count = 1
+    while not next(positions)[2]:
+        count += 1
+    return count
 
-    # Allergen Information box
-    allergen_lines = sticker.allergen_information.split("\n")
-    if design.print_allergen_heading:
-        draw_wrapped_text(c, design.allergen_heading_text, content_x + design.allergen_info_position['left']*mm, content_y + content_height - design.allergen_info_position['top']*mm, max_width=design.allergen_info_position['max_width']*mm, font_size=design.allergen_heading_font_size)
-        draw_multiline_text(c, allergen_lines, content_x + design.allergen_info_position['left']*mm, content_y + content_height - (design.allergen_info_position['top'] + (design.allergen_info_position.get('font_size', design.content_font_size)*0.7))*mm, max_width=design.allergen_info_position['max_width']*mm, font_size=design.allergen_info_position.get('font_size', design.content_font_size))
-    else:
-        draw_multiline_text(c, allergen_lines, content_x + design.allergen_info_position['left']*mm, content_y + content_height - design.allergen_info_position['top']*mm, max_width=design.allergen_info_position['max_width']*mm, font_size=design.allergen_info_position.get('font_size', design.content_font_size))
+def draw_sticker(c, sticker, plan):
+    """Draw the product-specific fields at the origin; the store layer is drawn separately."""
+    for op in plan.product_ops:
+        text = op.text if op.field is None else PRODUCT_FIELD_TEXT[op.field](sticker)
+        execute_op(c, op, text)
 
-    # Ingredients box
-    ingredients_lines = sticker.ingredients.split("\n")
-    if design.print_ingredients_heading:
-        draw_wrapped_text(c, design.ingredients_heading_text, content_x + design.ingredients_position['left']*mm, content_y + content_height - design.ingredients_position['top']*mm, max_width=design.ingredients_position['max_width']*mm, font_size=design.ingredients_heading_font_size)
-        draw_multiline_text(c, ingredients_lines, content_x + design.ingredients_position['left']*mm, content_y + content_height - (design.ingredients_position['top'] + (design.ingredients_position.get('font_size', design.content_font_size)*0.7))*mm, max_width=design.ingredients_position['max_width']*mm, font_size=design.ingredients_position.get('font_size', design.content_font_size))
-    else:
-        draw_multiline_text(c, ingredients_lines, content_x + design.ingredients_position['left']*mm, content_y + content_height - design.ingredients_position['top']*mm, max_width=design.ingredients_position['max_width']*mm, font_size=design.ingredients_position.get('font_size', design.content_font_size))
-
-def draw_multiline_text(c, lines, x, y, max_width, font_size, bold=False):
-    styles = getSampleStyleSheet()
-    styleN = styles['Normal']
-    styleN.fontName = 'RobotoCondensed'
-    styleN.fontSize = font_size
-    if bold:
-        styleN.fontWeight = 'bolder'  # Apply bold style
+# Number of wrapped text blocks kept per process; ingredients/nutrition blocks of a whole catalog fit easily
+TEXT_LAYOUT_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=None)
+def get_paragraph_style(font_name, font_size, leading):
+    """Return the shared ParagraphStyle for one font face (which fixes the weight), size and leading."""
+    return ParagraphStyle(f'Sticker-{font_name}-{font_size}-{leading}', fontName=font_name, fontSize=font_size, leading=leading)
+
+@lru_cache(maxsize=TEXT_LAYOUT_CACHE_SIZE)
+def layout_text(text, max_width, font_size, font_name=REGULAR_FONT):
+    """Wrap text to max_width once per process; returns the wrapped Paragraph and its height."""
+    style = get_paragraph_style(font_name, font_size, font_size + 0.7)  # Adjust leading for better spacing if needed
+    p = Paragraph(text, style)
+    w, h = p.wrap(max_width, 100*mm)
+    return p, h
+
+# Text cache statistics; create_app gives it a handler at INFO, as the app logger only shows warnings in production
+stats_logger = logging.getLogger('app.sticker.stats')
+
+_stats_logged_at = [0.0]
+
+def text_cache_summary():
+    """One line with the hit rate and size of each text layout cache."""
+    parts = []
+    for name, cache in [('wrap', wrap_plain_text), ('paragraph', layout_text), ('width', string_width)]:
+        info = cache.cache_info()
+        lookups = info.hits + info.misses
+        hit_rate = 100.0 * info.hits / lookups if lookups else 0.0
+        parts.append(f'{name} {hit_rate:.1f}% of {lookups} ({info.currsize}/{info.maxsize})')
+    return 'Text cache hit rates: ' + ', '.join(parts)
+
+def log_text_cache_stats():
+    """Log text_cache_summary() at most once every TEXT_CACHE_STATS_INTERVAL seconds (0 never logs)."""
+    interval = current_app.config['TEXT_CACHE_STATS_INTERVAL']
+    now = time.monotonic()
+    if not interval or now - _stats_logged_at[0] < interval:
+        return
+    _stats_logged_at[0] = now
+    stats_logger.info(text_cache_summary())
+
+@lru_cache(maxsize=TEXT_LAYOUT_CACHE_SIZE)
+def string_width(text, font_name, font_size):
+    return pdfmetrics.stringWidth(text, font_name, font_size)
+
+def _split_long_word(word, max_width, font_name, font_size):
+    """Break a word wider than max_width into pieces that fit, as Paragraph does with splitLongWords."""
+    pieces, piece = [], ''
+    for char in word:
+        if piece and string_width(piece + char, font_name, font_size) > max_width:
+            pieces.append(piece)
+            piece = char
+        else:
+            piece += char
+    pieces.append(piece)
+    return pieces
+
+@lru_cache(maxsize=TEXT_LAYOUT_CACHE_SIZE)
+def wrap_plain_text(text, max_width, font_size, font_name=REGULAR_FONT):
+    """Greedy line breaking of plain text, matching Paragraph's wrapping; returns a tuple of lines."""
+    space_width = string_width(' ', font_name, font_size)
+    lines, line, line_width = [], [], 0
+    for word in text.split():
+        word_width = string_width(word, font_name, font_size)
+        if word_width > max_width:
+            pieces = _split_long_word(word, max_width, font_name, font_size)
+            if line:
+                lines.append(' '.join(line))
+            lines.extend(pieces[:-1])
+            word, word_width, line = pieces[-1], string_width(pieces[-1], font_name, font_size), []
+        if line and line_width + space_width + word_width > max_width:
+            lines.append(' '.join(line))
+            line, line_width = [], 0
+        line_width = line_width + space_width + word_width if line else word_width
+        line.append(word)
+    if line:
+        lines.append(' '.join(line))
+    return tuple(lines)
+
+def draw_plain_text(c, text, x, y, max_width, font_size, font_name=REGULAR_FONT):
+    """Draw text without markup parsing; `&` and `<` are printed literally."""
+    lines = wrap_plain_text(text, max_width, font_size, font_name)
+    if not lines:
+        return
+    # Same geometry as Paragraph: first baseline one font size below the top, leading of font size + 0.7
+    text_object = c.beginText(x, y - font_size)
+    text_object.setFont(font_name, font_size, font_size + 0.7)
+    text_object.setFillColor(black)
     for line in lines:
-        draw_wrapped_text(c, line, x, y, max_width, font_size, bold)
-        y -= font_size * 1.15  # Adjust the line spacing as needed
+        text_object.textLine(line)
+    c.drawText(text_object)
 
-def draw_wrapped_text(c, text, x, y, max_width, font_size, bold=False):
-    styles = getSampleStyleSheet()
-    styleN = styles['Normal']
-    styleN.fontName = 'RobotoCondensed'
-    styleN.fontSize = font_size
-    styleN.leading = font_size + 0.7  # Adjust leading for better spacing if needed
-    if bold:
-        styleN.fontWeight = 'bolder'  # Apply bold style
+def draw_multiline_text(c, lines, x, y, max_width, font_size, font_name=REGULAR_FONT, rich=False):
+    for line in lines:
+        draw_wrapped_text(c, line, x, y, max_width, font_size, font_name, rich)
+        y -= font_size * 1.15  # Adjust the line spacing as needed
 
-    # Create a Paragraph with the text
-    p = Paragraph(text, styleN)
+def draw_wrapped_text(c, text, x, y, max_width, font_size, font_name=REGULAR_FONT, rich=False):
+    if not rich:
+        draw_plain_text(c, text, x, y, max_width, font_size, font_name)
+        return
 
-    # Calculate the width and height of the Paragraph
-    w, h = p.wrap(max_width, 100*mm)
+    p, h = layout_text(text, max_width, font_size, font_name)
 
-    # Draw the Paragraph
-    p.drawOn(c, x, y - h)
+    # Draw a shallow copy: drawOn attaches the canvas to the flowable, and the cached one is shared
+    copy.copy(p).drawOn(c, x, y - h)
 
-def draw_nutritional_heading(c, text, x, y, max_width, font_size):
+def draw_nutritional_heading(c, text, x, y, max_width, font_size, font_name=SEMIBOLD_FONT):
     lines = text.split('\n')
     if len(lines) != 2:
         raise ValueError("Nutritional heading must have exactly two lines")
@@ -203,15 +526,79 @@ def draw_nutritional_heading(c, text, x, y, max_width, font_size):
     c.setFillColor(black)
 
     # Draw the first line (Nutritional Facts) with the larger font size
-    c.setFont('RobotoCondensed', font_size)
+    c.setFont(font_name, font_size)
     c.drawString(x, y, lines[0])
 
     # Draw the second line (Serving size) with a slightly smaller font size
-    c.setFont('RobotoCondensed', font_size - 1.5)
+    c.setFont(font_name, font_size - 1.5)
     c.drawString(x, y - font_size * 1.0, lines[1])
 
-def create_stickers_pdf(stickers):
-    # Create a PDF file in the root directory
-    pdf_path = os.path.join(current_app.root_path, '..', 'stickers_to_print.pdf')
-    create_sticker_pdf(stickers, pdf_path)
-    return pdf_path
+def iter_file_chunks(f, chunk_size=64 * 1024):
+    """Yield f in chunks for a streamed response, closing it when done (or when the client goes away)."""
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+def sticker_artifact_id(runs, layout, printer_copies=False):
+    """Content hash of a print job: design and store info versions plus every printed field and count."""
+    plan, store_layer = layout
+    return artifact_id_for('sticker-copies' if printer_copies else 'stickers', plan.key, store_layer.key,
+                           [(sticker.key(), count) for sticker, count in runs])
+
+def job_ticket(runs, plan, artifact_id):
+    """Job ticket for a printer-copies PDF: page n is printed runs[n - 1].count times."""
+    return {
+        'document': f'{artifact_id}.pdf',
+        'media': {'width_mm': round(plan.width / mm, 2), 'height_mm': round(plan.height / mm, 2)},
+        'total_labels': sum(count for _, count in runs),
+        'pages': [
+            {'page': page, 'copies': count, 'product_name': sticker.product_name, 'batch_number': sticker.batch_number}
+            for page, (sticker, count) in enumerate(runs, start=1)
+        ],
+    }
+
+def create_stickers_pdf(runs, progress=None, printer_copies=False, layout=None):
+    """
+    Return the artifact id of the PDF for these runs, rendering it only when it is not already cached.
+    If STICKER_PARALLEL_THRESHOLD is set, jobs of that many stickers or more are rendered across STICKER_RENDER_PROCESSES processes.
+
+    With printer_copies, each distinct sticker is rendered once and the copy counts go to the printer
+    instead: a JSON job ticket stored next to the PDF, plus /NumCopies when the job is a single run.
+    """
+    from app.parallel_render import create_sticker_pdf_parallel, parallel_render_available
+    layout = layout or load_sticker_layout()
+    plan = layout[0]
+    artifact_id = sticker_artifact_id(runs, layout, printer_copies)
+    num_copies = None
+    if printer_copies:
+        if plan.printer_type != 'label':
+            raise ValueError('Printer copies need a sticker design for a label printer')
+        if get_artifact(artifact_id, 'json') is None:
+            with write_artifact(artifact_id, 'json') as f:
+                f.write(json.dumps(job_ticket(runs, plan, artifact_id), indent=2).encode('utf-8'))
+        num_copies = runs[0].count if len(runs) == 1 else None
+        runs = [StickerRun(sticker, 1) for sticker, _ in runs]
+    if get_artifact(artifact_id) is None:
+        total = sum(count for _, count in runs)
+        processes = current_app.config['STICKER_RENDER_PROCESSES'] or os.cpu_count() or 1
+        threshold = current_app.config['STICKER_PARALLEL_THRESHOLD']
+        parallel = (processes > 1 and threshold and total >= threshold and
+                    parallel_render_available() and not num_copies)
+        with write_artifact(artifact_id) as f:
+            if parallel:
+                try:
+                    create_sticker_pdf_parallel(runs, f, layout, processes, current_app.root_path, progress=progress)
+                except Exception as e:
+                    current_app.logger.error(f'Parallel render failed, rendering in one process: {str(e)}')
+                    f.seek(0)
+                    f.truncate()
+                    parallel = False
+            if not parallel:
+                create_sticker_pdf(runs, f, layout, progress, num_copies)
+                log_text_cache_stats()
+    return artifact_id
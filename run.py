@@ -4,6 +4,7 @@ from app.models import User, Product, PrintJob, ProductCategory
 from app.main.backups import start_scheduler
 from dotenv import load_dotenv
 import os
+import click
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Load environment variables from .env file
@@ -18,6 +19,107 @@ migrate = Migrate(app, db)
 def make_shell_context():
     return {'db': db, 'User': User, 'Product': Product, 'PrintJob': PrintJob, 'ProductCategory': ProductCategory}
 
+@app.cli.command('bench-stickers')
+@click.option('--count', default=500, help='Number of distinct stickers to render.')
+def bench_stickers(count):
+    """Compare per-sticker render time of the Paragraph and plain-text engines."""
+    from app.bench import benchmark_text_engines
+    result = benchmark_text_engines(count)
+    click.echo(f"Rendered {result['stickers']} distinct stickers with the default design")
+    click.echo(f"  Paragraph engine:  {result['paragraph_ms']:.3f} ms/sticker")
+    click.echo(f"  Plain-text engine: {result['plain_ms']:.3f} ms/sticker")
+    click.echo(f"  Speedup:           {result['paragraph_ms'] / result['plain_ms']:.1f}x")
+    from app.sticker import text_cache_summary
+    click.echo(f"  {text_cache_summary()}")
+
+@app.cli.command('bench-parallel')
+@click.option('--labels', default=20000, help='Number of stickers in the job.')
+@click.option('--processes', default=None, help='Comma-separated process counts (default: 1, 2, 4, ... up to the core count).')
+@click.option('--printer-type', default='normal', type=click.Choice(['normal', 'label']), help='Sheet or label printer design.')
+def bench_parallel(labels, processes, printer_type):
+    """Compare single-process rendering of a large job with sharded multi-process rendering."""
+    from app.bench import benchmark_parallel_render
+    from app.parallel_render import parallel_render_available
+    if not parallel_render_available():
+        raise click.ClickException('Parallel rendering needs the pypdf package')
+    if processes:
+        counts = [int(n) for n in processes.split(',')]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= (os.cpu_count() or 1):
+            counts.append(counts[-1] * 2)
+    result = benchmark_parallel_render(labels, counts, app.root_path, printer_type=printer_type)
+    click.echo(f"Rendered {result['labels']} stickers for a {printer_type} printer ({result['cpu_count']} cores)")
+    click.echo(f"  single process: {result['serial_seconds']:.2f} s  {result['serial_bytes'] / 1024 / 1024:.2f} MB")
+    click.echo(f"  stitching only: {result['stitch_seconds']:.2f} s")
+    for row in result['parallel']:
+        click.echo(f"  {row['processes']:>2} processes:   {row['seconds']:.2f} s  {row['bytes'] / 1024 / 1024:.2f} MB  ({row['speedup']:.2f}x)")
+
+@app.cli.command('bench-autocomplete')
+@click.option('--products', default=10000, help='Number of products in the index.')
+def bench_autocomplete(products):
+    """Report the memory and lookup time of the in-process product autocomplete index."""
+    from app.bench import benchmark_autocomplete
+    result = benchmark_autocomplete(products)
+    click.echo(f"Indexed {result['products']} products ({result['trigrams']} distinct trigrams)")
+    click.echo(f"  memory:      {result['memory_bytes'] / 1024 / 1024:.2f} MB ({result['bytes_per_10k'] / 1024 / 1024:.2f} MB per 10k products)")
+    click.echo(f"  lookup time: {result['lookup_ms']:.3f} ms")
+
+@app.cli.command('check-queries')
+@click.option('--user', 'username', default=None, help='User to request the pages as (defaults to the first store admin).')
+def check_queries(username):
+    """Count the SQL statements each listing endpoint issues and fail if any is over its budget."""
+    from app.bench import listing_query_counts
+    query = User.query.filter_by(username=username) if username else User.query.filter_by(role='store_admin')
+    user = query.order_by(User.id).first()
+    if user is None:
+        raise click.ClickException('No such user')
+    over_budget = []
+    for row in listing_query_counts(app, user):
+        click.echo(f"  {row['path']:<28} {row['status']}  {row['queries']} queries (budget {row['budget']})")
+        if row['status'] != 200 or row['queries'] > row['budget']:
+            over_budget.append(row['path'])
+    if over_budget:
+        raise click.ClickException(f"Over budget or failing: {', '.join(over_budget)}")
+
+@app.cli.command('check-label-golden')
+@click.option('--update', is_flag=True, help='Rewrite the golden files that differ instead of failing.')
+def check_label_golden(update):
+    """Render the fixed ZPL and TSPL jobs and fail if any differs from its golden file in app/golden."""
+    from app.label_golden import check_label_goldens
+    failed = []
+    for name, status, diff in check_label_goldens(app.root_path, update=update):
+        click.echo(f'  {name:<28} {status}')
+        for line in diff:
+            click.echo(f'    {line}')
+        if status in ('differs', 'missing'):
+            failed.append(name)
+    if failed:
+        raise click.ClickException(f"Output differs from the golden files: {', '.join(failed)} "
+                                   "(run with --update if the change is intended)")
+
+@app.cli.command('render-worker')
+@click.option('--threads', default=None, type=int, help='Worker threads (defaults to RENDER_WORKERS).')
+def render_worker(threads):
+    """Run a dedicated process that renders queued sticker jobs, and sends them to printers, until interrupted."""
+    from app.print_queue import start_render_workers, worker_loop
+    from app.print_dispatch import start_dispatch_workers
+    threads = threads or app.config['RENDER_WORKERS']
+    click.echo(f'Rendering queued sticker jobs with {threads} thread(s)')
+    start_dispatch_workers(app)
+    start_render_workers(app, threads - 1)
+    worker_loop(app)
+
+@app.cli.command('fake-printer')
+@click.option('--port', default=9100, help='TCP port to listen on.')
+@click.option('--out', default='fake-printer', help='Directory to write received jobs to.')
+@click.option('--drop-after', default=0, help='Hang up on the first connection after this many bytes (0 never does).')
+def fake_printer(port, out, drop_after):
+    """Listen like a raw (port 9100) label printer and save what it receives, for testing without hardware."""
+    from app.fake_printer import serve_fake_printer
+    click.echo(f'Fake printer listening on port {port}, writing jobs to {out}')
+    serve_fake_printer(port, out, drop_after=drop_after)
+
 def start_app():
     port = int(os.environ.get('PORT', 5000))
     host = '0.0.0.0'